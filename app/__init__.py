@@ -1,9 +1,27 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 
 from config import config
+from .database import Database
+from .caches import SharedCache
+from .caches import CredentialCache
+from .caches import PrincipalCache
+from .caches import UnknownUserCache
+from .caches import ResponseCache
+from .ratelimit import RateLimiter
+from .compression import Compression
+from .instrumentation import Instrumentation
+from .serialization import Serializer
 
-db = SQLAlchemy()
+db = Database()
+shared_cache = SharedCache()
+credential_cache = CredentialCache()
+principal_cache = PrincipalCache()
+unknown_user_cache = UnknownUserCache()
+response_cache = ResponseCache()
+rate_limiter = RateLimiter()
+instrumentation = Instrumentation()
+compression = Compression()
+serializer = Serializer()
 
 
 def create_app(config_name):
@@ -12,6 +30,16 @@ def create_app(config_name):
     config[config_name].init_app(app)
 
     db.init_app(app)
+    shared_cache.init_app(app)
+    credential_cache.init_app(app)
+    principal_cache.init_app(app)
+    unknown_user_cache.init_app(app)
+    response_cache.init_app(app)
+    rate_limiter.init_app(app)
+    # before compression, so that its timings include compressing
+    instrumentation.init_app(app)
+    compression.init_app(app)
+    serializer.init_app(app)
 
     from .api_1_0 import api as api_1_0_blueprint
     app.register_blueprint(api_1_0_blueprint, url_prefix='/api/v1.0')
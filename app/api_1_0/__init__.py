@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import users, posts, errors, authentication
+from . import users, posts, metrics, errors, authentication, capture
@@ -1,9 +1,13 @@
 from flask import g
-from flask import jsonify
 from flask_httpauth import HTTPBasicAuth
 
+from .. import credential_cache
+from .. import rate_limiter
+from ..serialization import jsonify
+from ..instrumentation import timer
 from ..models import User
 from ..models import AnonymousUser
+from ..models import Principal
 from . import api
 from .errors import forbidden
 
@@ -11,22 +15,21 @@ auth = HTTPBasicAuth()
 
 
 @auth.verify_password
+@timer('auth')
 def verify_password(name_or_email_or_token, password):
     if name_or_email_or_token == '':
         g.current_user = AnonymousUser()
         return True
     if password == '':
-        g.current_user = User.verify_auth_token(name_or_email_or_token)
+        g.current_user = Principal.from_token(name_or_email_or_token)
         g.token_used = True
         return g.current_user is not None
-    user = User.query.filter_by(username=name_or_email_or_token).first()
-    if not user:
-        user = User.query.filter_by(email=name_or_email_or_token).first()
+    user = User.find_by_login(name_or_email_or_token)
     if not user:
         return False
     g.current_user = user
     g.token_used = False
-    return user.verify_password(password)
+    return credential_cache.verify(user, password)
 
 
 @api.route('/token')
@@ -41,9 +44,17 @@ def get_token():
 
 @auth.error_handler
 def auth_error():
+    rate_limiter.auth_failed()
     return forbidden('Invalid credentials')
 
 
+# runs before authentication, so that throttled clients cost no password
+# hash or user lookup
+@api.before_request
+def rate_limit():
+    rate_limiter.check_request()
+
+
 @api.before_request
 @auth.login_required
 def before_request():
@@ -0,0 +1,67 @@
+"""Appends a record of each API request to ``CAPTURE_FILE``, for replaying
+production traffic with ``flask replay``.
+
+Records are JSON lines with the method, path, query arguments, endpoint,
+auth class, status and duration of a request; credentials are never
+written. ``CAPTURE_SAMPLE_RATE`` keeps only a share of the requests and
+``CAPTURE_BODIES`` adds the JSON body of writes, with password and token
+fields redacted.
+"""
+import os
+import time
+import random
+from flask import g
+from flask import request
+from flask import current_app
+
+from .. import response_cache
+from ..serialization import json_dumps
+from . import api
+
+REDACTED = '<redacted>'
+SECRET_FIELDS = ('password', 'token', 'key', 'secret')
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {name: REDACTED if any(secret in name.lower()
+                                      for secret in SECRET_FIELDS)
+                else redact(item) for name, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def auth_class():
+    if 'current_user' not in g:
+        return 'none'
+    return response_cache.auth_class()
+
+
+@api.after_request
+def capture(response):
+    config = current_app.config
+    path = config['CAPTURE_FILE']
+    if not path or random.random() >= config['CAPTURE_SAMPLE_RATE']:
+        return response
+    record = {
+        'time': time.time(),
+        'method': request.method,
+        'path': request.path,
+        'args': redact(request.args.to_dict(flat=False)),
+        'endpoint': request.endpoint,
+        'auth': auth_class(),
+        'status': response.status_code,
+    }
+    if 'request_start' in g:
+        record['duration'] = (time.perf_counter() - g.request_start) * 1000
+    if config['CAPTURE_BODIES'] and request.method not in ('GET', 'HEAD'):
+        record['body'] = redact(request.get_json(silent=True))
+    # one write of one line, so that the records of concurrent workers
+    # appending to the same file do not interleave
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, (json_dumps(record) + '\n').encode('utf-8'))
+    finally:
+        os.close(fd)
+    return response
@@ -0,0 +1,62 @@
+import hashlib
+from flask import request
+from flask import current_app
+
+from .. import db
+from ..models import Post
+
+
+def make_etag(*parts):
+    """A strong ETag over the request URL and ``parts``."""
+    key = '|'.join([request.url] + [str(part) for part in parts])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response when the request's validators still match.
+
+    ``If-None-Match`` takes precedence over ``If-Modified-Since``.
+    """
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        matched = last_modified.replace(microsecond=0) <= \
+            request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return set_validators(current_app.response_class(status=304),
+                          etag, last_modified)
+
+
+def post_validators(post):
+    return make_etag(post.id, post.updated_at, post.body_html_digest), \
+        post.updated_at
+
+
+def page_validators(query, page, newest=None):
+    """Validators of a page of posts taken from ``query``.
+
+    The ETag covers the posts on the page and its links. Last-Modified is
+    the latest edit on the page or the newest post of the whole listing,
+    which shifts every page when it is added. Without ``query``, the newest
+    post is the ``newest`` creation time given by the caller.
+    """
+    etag = make_etag(page.count, page.prev, page.next,
+                     *[(post.id, post.updated_at, post.body_html_digest)
+                       for post in page.items])
+    if query is not None:
+        newest = query.order_by(None) \
+            .with_entities(db.func.max(Post.created_at)).scalar()
+    stamps = [post.updated_at for post in page.items]
+    if newest is not None:
+        stamps.append(newest)
+    return etag, max(stamps) if stamps else None
@@ -1,8 +1,9 @@
-from flask import jsonify
-
+import math
 from ..exceptions import ValidationError
 from ..exceptions import NotFoundError
 from ..exceptions import ForbiddenError
+from ..exceptions import TooManyRequestsError
+from ..serialization import jsonify
 from . import api
 
 
@@ -36,6 +37,13 @@ def not_allowed(message):
     return response
 
 
+def too_many_requests(message, retry_after):
+    response = jsonify({'error': 'too many requests', 'message': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
+
 def server_error(message):
     response = jsonify({'error': 'internal error', 'message': message})
     response.status_code = 500
@@ -85,3 +93,8 @@ def not_found_error(e):
 @api.errorhandler(ForbiddenError)
 def forbidden_error(e):
     return forbidden(e.args[0])
+
+
+@api.errorhandler(TooManyRequestsError)
+def too_many_requests_error(e):
+    return too_many_requests(e.args[0], e.retry_after)
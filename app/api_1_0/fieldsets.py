@@ -0,0 +1,86 @@
+from flask import request
+
+from .. import db
+from ..models import Post
+from ..exceptions import ValidationError
+
+# columns each JSON field is built from
+FIELD_COLUMNS = {
+    'url': ['slug'],
+    'title': ['title'],
+    'body': ['body'],
+    'body_html': ['body_html'],
+    'created_at': [],
+    'updated_at': [],
+    'author': ['author_id'],
+}
+
+# always loaded: pagination and the validators use them
+BASE_COLUMNS = ['id', 'created_at', 'updated_at', 'body_html_digest']
+
+
+class PostFieldset(object):
+    """The fields of the posts in a listing.
+
+    ``fields`` is a comma-separated subset of ``Post.JSON_FIELDS``, and
+    ``excerpt=N`` adds the first ``N`` characters of the body. An excerpt
+    without ``fields`` leaves out the full body. Only the columns behind the
+    chosen fields are selected.
+    """
+
+    def __init__(self, fields=Post.JSON_FIELDS, excerpt=None):
+        self.fields = fields
+        self.excerpt = excerpt
+
+    @staticmethod
+    def from_request():
+        fields = request.args.get('fields')
+        excerpt = request.args.get('excerpt')
+        if excerpt is not None:
+            try:
+                excerpt = int(excerpt)
+            except ValueError:
+                excerpt = 0
+            if excerpt <= 0:
+                raise ValidationError(
+                    'Excerpt length must be a positive integer')
+        if fields is None:
+            if excerpt is None:
+                return PostFieldset()
+            fields = tuple(field for field in Post.JSON_FIELDS
+                           if field not in ('body', 'body_html'))
+            return PostFieldset(fields, excerpt)
+        fields = tuple(field for field in fields.split(',') if field)
+        unknown = [field for field in fields if field not in FIELD_COLUMNS]
+        if unknown:
+            raise ValidationError('Unknown field: ' + ', '.join(unknown))
+        return PostFieldset(fields, excerpt)
+
+    @property
+    def values(self):
+        """Query arguments carrying the fieldset into pagination links."""
+        values = {}
+        if 'fields' in request.args:
+            values['fields'] = request.args['fields']
+        if self.excerpt is not None:
+            values['excerpt'] = self.excerpt
+        return values
+
+    def apply(self, query):
+        columns = set(BASE_COLUMNS)
+        for field in self.fields:
+            columns.update(FIELD_COLUMNS[field])
+        options = [db.load_only(*columns)]
+        if 'author' in self.fields:
+            options.append(db.joinedload(Post.author).load_only('username'))
+        return query.options(*options)
+
+    def to_json(self, posts):
+        json_posts = [post.to_json(self.fields) for post in posts]
+        if self.excerpt is not None and posts:
+            excerpts = dict(db.session.query(
+                Post.id, db.func.substr(Post.body, 1, self.excerpt))
+                .filter(Post.id.in_([post.id for post in posts])))
+            for post, json_post in zip(posts, json_posts):
+                json_post['excerpt'] = excerpts[post.id]
+        return json_posts
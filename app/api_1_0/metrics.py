@@ -0,0 +1,24 @@
+from flask import current_app
+
+from .. import db
+from .. import instrumentation
+from ..models import Permission
+from ..serialization import jsonify
+from . import api
+from .decorators import permission_required
+
+
+@api.route('/metrics/pool')
+@permission_required(Permission.ADMINISTER)
+def get_pool_metrics():
+    binds = current_app.config['SQLALCHEMY_BINDS'] or {}
+    pools = {'default': db.pool_metrics()}
+    for bind in binds:
+        pools[bind] = db.pool_metrics(bind=bind)
+    return jsonify({'pools': pools})
+
+
+@api.route('/metrics/requests')
+@permission_required(Permission.ADMINISTER)
+def get_request_metrics():
+    return jsonify(instrumentation.to_json())
@@ -0,0 +1,169 @@
+import base64
+import binascii
+from datetime import datetime
+from flask import request
+from flask import url_for
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_
+from sqlalchemy import or_
+
+from ..models import Post
+from ..exceptions import ValidationError
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class Page(object):
+    def __init__(self, items, prev=None, next=None, count=None):
+        self.items = items
+        self.prev = prev
+        self.next = next
+        self.count = count
+
+
+def encode_cursor(direction, *values):
+    raw = '|'.join([direction] + [str(v) for v in values])
+    encoded = base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+    return encoded.rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+    except (binascii.Error, ValueError, UnicodeError):
+        raise ValidationError('Invalid cursor')
+    return raw.split('|')
+
+
+def post_cursor(direction, post):
+    return encode_cursor(direction,
+                         post.created_at.strftime(CURSOR_DATETIME_FORMAT),
+                         post.id)
+
+
+def decode_post_cursor(cursor):
+    parts = decode_cursor(cursor)
+    if len(parts) != 3 or parts[0] not in ('n', 'p'):
+        raise ValidationError('Invalid cursor')
+    try:
+        created_at = datetime.strptime(parts[1], CURSOR_DATETIME_FORMAT)
+        post_id = int(parts[2])
+    except ValueError:
+        raise ValidationError('Invalid cursor')
+    return parts[0], created_at, post_id
+
+
+def seek_posts(query, direction, created_at, post_id):
+    """Filter ``query`` to the posts after ``(created_at, id)``, going
+    backwards in time for ``'n'`` and forwards for ``'p'``.
+
+    The bound on ``created_at`` alone lets SQLite search the created_at
+    index; the OR on its own is not sargable and scans the table.
+    """
+    if direction == 'n':
+        return query.filter(Post.created_at <= created_at, or_(
+            Post.created_at < created_at,
+            and_(Post.created_at == created_at, Post.id < post_id)))
+    return query.filter(Post.created_at >= created_at, or_(
+        Post.created_at > created_at,
+        and_(Post.created_at == created_at, Post.id > post_id)))
+
+
+def paginate_posts(query, endpoint, total=None, **values):
+    """Paginate a post query newest first.
+
+    Pages are addressed by ``page`` (offset) unless a ``cursor`` argument is
+    present, in which case the query seeks on ``(created_at, id)`` and the
+    total is only counted when ``count=1`` is asked for. A ``total`` known
+    by the caller, such as ``User.post_count``, saves counting the query.
+    """
+    per_page = current_app.config['POSTS_PER_PAGE']
+    if 'cursor' not in request.args:
+        page = max(request.args.get('page', 1, type=int), 1)
+        # posts created together (imports, fake data) tie on created_at
+        query = query.order_by(Post.created_at.desc(), Post.id.desc())
+        if total is None:
+            pagination = query.paginate(page, per_page=per_page,
+                                        error_out=False)
+        else:
+            items = query.limit(per_page).offset((page - 1) * per_page).all()
+            pagination = Pagination(query, page, per_page, total, items)
+        prev = None
+        if pagination.has_prev:
+            prev = url_for(endpoint, page=page-1, _external=True, **values)
+        next = None
+        if pagination.has_next:
+            next = url_for(endpoint, page=page+1, _external=True, **values)
+        return Page(pagination.items, prev, next, pagination.total)
+
+    cursor = request.args.get('cursor', '')
+    count = request.args.get('count', 0, type=int)
+    if count:
+        values['count'] = count
+    direction = 'n'
+    seek = query
+    if cursor:
+        direction, created_at, post_id = decode_post_cursor(cursor)
+        seek = seek_posts(query, direction, created_at, post_id)
+    if direction == 'n':
+        seek = seek.order_by(Post.created_at.desc(), Post.id.desc())
+    else:
+        seek = seek.order_by(Post.created_at.asc(), Post.id.asc())
+    items = seek.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'n':
+        has_prev, has_next = bool(cursor), has_more
+    else:
+        items.reverse()
+        has_prev, has_next = has_more, True
+
+    prev = None
+    if has_prev and items:
+        prev = url_for(endpoint, cursor=post_cursor('p', items[0]),
+                       _external=True, **values)
+    next = None
+    if has_next and items:
+        next = url_for(endpoint, cursor=post_cursor('n', items[-1]),
+                       _external=True, **values)
+    if not count:
+        total = None
+    elif total is None:
+        total = query.order_by(None).count()
+    return Page(items, prev, next, total)
+
+
+def decode_rank_cursor(cursor):
+    parts = decode_cursor(cursor)
+    if len(parts) != 3 or parts[0] != 'n':
+        raise ValidationError('Invalid cursor')
+    try:
+        return float(parts[1]), int(parts[2])
+    except ValueError:
+        raise ValidationError('Invalid cursor')
+
+
+def paginate_ranked(query, rank, endpoint, **values):
+    """Paginate search results best first.
+
+    The query seeks on ``(rank, id)`` from the ``cursor`` argument, and only
+    links to the next page.
+    """
+    per_page = current_app.config['POSTS_PER_PAGE']
+    cursor = request.args.get('cursor')
+    if cursor:
+        last_rank, post_id = decode_rank_cursor(cursor)
+        query = query.filter(or_(
+            rank > last_rank, and_(rank == last_rank, Post.id > post_id)))
+    rows = query.add_columns(rank).order_by(rank, Post.id) \
+        .limit(per_page + 1).all()
+    next = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        post, last_rank = rows[-1]
+        next = url_for(endpoint,
+                       cursor=encode_cursor('n', repr(last_rank), post.id),
+                       _external=True, **values)
+    return Page([post for post, _ in rows], None, next)
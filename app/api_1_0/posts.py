@@ -1,48 +1,127 @@
 from flask import g
-from flask import jsonify
 from flask import request
 from flask import url_for
 from flask import current_app
 
+from .. import db
 from ..models import Post
+from ..models import User
 from ..models import Permission
+from ..exceptions import ValidationError
 from ..validators import validate_request_json
-from .. import db
+from ..serialization import jsonify
+from .. import response_cache
 from . import api
 from .errors import forbidden
 from .errors import not_found
 from .decorators import permission_required
+from .pagination import paginate_posts
+from .pagination import paginate_ranked
+from .fieldsets import PostFieldset
+from .streaming import stream_posts
+from .conditional import make_etag
+from .conditional import not_modified
+from .conditional import set_validators
+from .conditional import page_validators
+from .conditional import post_validators
 
 
 @api.route('/posts/')
 @permission_required(Permission.READ_ARTICLES)
+@response_cache.cached('posts')
+@db.read_replica
 def get_posts():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.created_at.desc()).paginate(
-        page, per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_posts', page=page+1, _external=True)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    fieldset = PostFieldset.from_request()
+    if 'slugs' in request.args:
+        return lookup_posts(request.args['slugs'], fieldset)
+    if request.args.get('stream', 0, type=int):
+        return stream_posts(fieldset.apply(Post.query), fieldset)
+    page = paginate_posts(fieldset.apply(Post.query), 'api.get_posts',
+                          **fieldset.values)
+    etag, last_modified = page_validators(Post.query, page)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    return set_validators(jsonify({
+        'posts': fieldset.to_json(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count
+    }), etag, last_modified)
+
+
+def lookup_posts(slugs, fieldset):
+    """The posts of a comma-separated list of slugs, in the order given,
+    with one query for all of them."""
+    slugs = [slug for slug in slugs.split(',') if slug]
+    if not slugs:
+        raise ValidationError('No slugs to look up')
+    if len(slugs) > current_app.config['POSTS_LOOKUP_SIZE']:
+        raise ValidationError('Lookup has more than {} slugs'.format(
+            current_app.config['POSTS_LOOKUP_SIZE']))
+    # slugs match results to the request even when they are not a field
+    posts = fieldset.apply(Post.query).options(db.undefer('slug')) \
+        .filter(Post.slug.in_(set(slugs))).all()
+    by_slug = {post.slug: post for post in posts}
+    etag = make_etag(*[(slug, post.id, post.updated_at,
+                        post.body_html_digest)
+                       for slug, post in sorted(by_slug.items())])
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    json_posts = dict(zip([post.slug for post in posts],
+                          fieldset.to_json(posts)))
+    results = []
+    found = 0
+    for slug in slugs:
+        if slug in by_slug:
+            found += 1
+            results.append({'slug': slug, 'status': 'found',
+                            'post': json_posts[slug]})
+        else:
+            results.append({'slug': slug, 'status': 'not found'})
+    return set_validators(jsonify({
+        'results': results,
+        'found': found,
+        'missing': len(results) - found,
+    }), etag)
+
+
+@api.route('/posts/search')
+@permission_required(Permission.READ_ARTICLES)
+@response_cache.cached('posts')
+@db.read_replica
+def search_posts():
+    q = request.args.get('q', '')
+    fieldset = PostFieldset.from_request()
+    query, rank = Post.search(q, fieldset.apply(Post.query))
+    page = paginate_ranked(query, rank, 'api.search_posts', q=q,
+                           **fieldset.values)
+    etag = make_etag(page.next, *[(post.id, post.updated_at,
+                                   post.body_html_digest)
+                                  for post in page.items])
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return set_validators(jsonify({
+        'posts': fieldset.to_json(page.items),
+        'next': page.next,
+    }), etag)
 
 
 @api.route('/posts/<string:slug>')
 @permission_required(Permission.READ_ARTICLES)
+@response_cache.cached('post:{slug}')
+@db.read_replica
 def get_post(slug):
     post = Post.query.filter_by(slug=slug).first()
     if post is None:
         return not_found('post not found')
-    return jsonify(post.to_json())
+    etag, last_modified = post_validators(post)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    return set_validators(jsonify(post.to_json()), etag, last_modified)
 
 
 @api.route('/posts/', methods=['POST'])
@@ -50,13 +129,45 @@ def get_post(slug):
 def new_post():
     validate_request_json()
     post = Post.from_json(request.json)
-    post.author = g.current_user
-    db.session.add(post)
-    db.session.commit()
+    post.author = User.query.get(g.current_user.id)
+    post.save()
+    response_cache.invalidate('posts', 'user-posts:' + post.author.username)
     return jsonify(post.to_json()), 201, \
         {'Location': url_for('api.get_post', slug=post.slug, _external=True)}
 
 
+@api.route('/posts/batch', methods=['POST'])
+@permission_required(Permission.WRITE_ARTICLES)
+def new_posts():
+    validate_request_json()
+    json_posts = request.json.get('posts') \
+        if isinstance(request.json, dict) else None
+    if not isinstance(json_posts, list):
+        raise ValidationError('Batch does not have a list of posts')
+    if len(json_posts) > current_app.config['POSTS_BATCH_SIZE']:
+        raise ValidationError('Batch has more than {} posts'.format(
+            current_app.config['POSTS_BATCH_SIZE']))
+    results = []
+    created = 0
+    for slug, error in Post.import_json(
+            json_posts, g.current_user.id,
+            chunk_size=current_app.config['POSTS_IMPORT_CHUNK_SIZE']):
+        if error is None:
+            created += 1
+            results.append({
+                'status': 'created',
+                'url': url_for('api.get_post', slug=slug, _external=True),
+            })
+        else:
+            results.append({'status': 'error', 'message': error})
+    response_cache.invalidate('posts', 'user-posts:' + g.current_user.username)
+    return jsonify({
+        'results': results,
+        'created': created,
+        'errors': len(results) - created,
+    })
+
+
 @api.route('/posts/<string:slug>', methods=['PUT'])
 @permission_required(Permission.WRITE_ARTICLES)
 def edit_post(slug):
@@ -64,10 +175,11 @@ def edit_post(slug):
     post = Post.query.filter_by(slug=slug).first()
     if post is None:
         return not_found('post not found')
-    if g.current_user != post.author:
+    if g.current_user.id != post.author_id:
         return forbidden('Insufficient permissions')
     post.title = request.json.get('title', post.title)
     post.body = request.json.get('body', post.body)
-    db.session.add(post)
-    db.session.commit()
+    post.save()
+    response_cache.invalidate('posts', 'post:' + slug, 'post:' + post.slug,
+                              'user-posts:' + post.author.username)
     return jsonify(post.to_json())
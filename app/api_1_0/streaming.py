@@ -0,0 +1,37 @@
+from itertools import islice
+from flask import current_app
+from flask import stream_with_context
+
+from .. import db
+from ..models import Post
+from ..serialization import dumps
+
+
+def stream_posts(query, fieldset):
+    """A chunked JSON response with every post of ``query``, newest first.
+
+    Posts are read from a server-side cursor in batches of
+    ``POSTS_STREAM_BATCH_SIZE`` and leave the session once encoded, so
+    memory does not grow with the listing.
+    """
+    batch_size = current_app.config['POSTS_STREAM_BATCH_SIZE']
+    posts = iter(query.order_by(Post.created_at.desc(), Post.id.desc())
+                 .execution_options(stream_results=True)
+                 .yield_per(batch_size))
+
+    def generate():
+        yield '{"posts": ['
+        separator = ''
+        while True:
+            batch = list(islice(posts, batch_size))
+            if not batch:
+                break
+            yield separator + ', '.join(
+                dumps(json_post) for json_post in fieldset.to_json(batch))
+            separator = ', '
+            for post in batch:
+                db.session.expunge(post)
+        yield ']}\n'
+
+    return current_app.response_class(stream_with_context(generate()),
+                                      mimetype='application/json')
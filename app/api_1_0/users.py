@@ -1,54 +1,68 @@
 from flask import g
-from flask import jsonify
 from flask import request
-from flask import current_app
 from flask import url_for
 
 from .. import db
+from .. import response_cache
 from ..models import User
-from ..models import Post
 from ..models import Permission
 from ..exceptions import NotFoundError
 from ..exceptions import ForbiddenError
 from ..exceptions import ValidationError
 from ..validators import validate_request_json
+from ..serialization import jsonify
 from ..validators import validate_username
 from ..validators import validate_password
 from ..validators import validate_email
 from . import api
 from .decorators import permission_required
+from .pagination import paginate_posts
+from .fieldsets import PostFieldset
+from .streaming import stream_posts
+from .conditional import make_etag
+from .conditional import not_modified
+from .conditional import set_validators
+from .conditional import page_validators
 
 
 @api.route('/users/<string:username>')
+@db.read_replica
 def get_user(username):
     user = User.query.filter_by(username=username).first()
     if user is None:
         raise NotFoundError('user not found')
-    return jsonify(user.to_json())
+    etag = make_etag(user.id, user.username, user.email, user.post_count,
+                     user.last_post_at)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return set_validators(jsonify(user.to_json()), etag)
 
 
 @api.route('/users/<string:username>/posts')
+@response_cache.cached('user-posts:{username}')
+@db.read_replica
 def get_user_posts(username):
     user = User.query.filter_by(username=username).first()
     if user is None:
         raise NotFoundError('user not found')
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.created_at.desc()).paginate(
-        page, per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_posts', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_posts', page=page+1, _external=True)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total,
-    })
+    fieldset = PostFieldset.from_request()
+    if request.args.get('stream', 0, type=int):
+        return stream_posts(fieldset.apply(user.posts), fieldset)
+    # the author's counters stand in for counting and dating the posts
+    page = paginate_posts(fieldset.apply(user.posts), 'api.get_user_posts',
+                          total=user.post_count, username=username,
+                          **fieldset.values)
+    etag, last_modified = page_validators(None, page, user.last_post_at)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    return set_validators(jsonify({
+        'posts': fieldset.to_json(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count,
+    }), etag, last_modified)
 
 
 @api.route('/users/', methods=['POST'])
@@ -61,6 +75,7 @@ def new_user():
     user = User.from_json(request.json)
     db.session.add(user)
     db.session.commit()
+    response_cache.invalidate('user-posts:' + user.username)
     return jsonify(user.to_json()), 201, \
         {'Location': url_for('api.get_user', username=user.username, _external=True)}
 
@@ -72,7 +87,7 @@ def change_password(username):
     user = User.query.filter_by(username=username).first()
     if user is None:
         raise ValidationError('user not found')
-    if not g.current_user.is_administrator() and g.current_user != user:
+    if not g.current_user.is_administrator() and g.current_user.id != user.id:
         raise ForbiddenError('Insufficient permissions')
     user.password = request.json.get('password')
     db.session.add(user)
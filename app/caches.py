@@ -0,0 +1,467 @@
+import os
+import hmac
+import time
+import pickle
+import random
+import sqlite3
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import g
+from flask import request
+from flask import current_app
+from werkzeug.urls import url_encode
+from werkzeug.utils import import_string
+
+# a SQLite backend deletes expired entries about once every this many sets
+SQLITE_PRUNE_EVERY = 1000
+
+
+class TTLCache(object):
+    """A thread-safe LRU mapping whose entries expire after ``ttl`` seconds.
+
+    A ``maxsize`` of 0 disables the cache: nothing is ever stored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires <= self.timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.timer() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            stale = [key for key, (value, _) in self._data.items()
+                     if predicate(value)]
+            for key in stale:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class AppCache(object):
+    """Base class of the per-application caches.
+
+    Each application gets its own :class:`TTLCache`, sized by the
+    ``<NAME>_SIZE`` and ``<NAME>_TTL`` configuration keys.
+    """
+    name = None
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        prefix = self.name.upper()
+        app.extensions[self.name] = TTLCache(
+            maxsize=app.config[prefix + '_SIZE'],
+            ttl=app.config[prefix + '_TTL'])
+
+    @property
+    def cache(self):
+        return current_app.extensions[self.name]
+
+
+class CredentialCache(AppCache):
+    """Remembers recently verified passwords so repeated HTTP Basic requests
+    skip the password hash check.
+
+    Entries are keyed on an HMAC of the user id, the stored password hash and
+    the supplied password, so a changed hash never matches an old entry.
+    """
+    name = 'credential_cache'
+
+    def init_app(self, app):
+        super(CredentialCache, self).init_app(app)
+        app.extensions['credential_cache_key'] = os.urandom(32)
+
+    def digest(self, user, password):
+        message = '{}:{}:{}'.format(user.id, user.password_hash, password)
+        return hmac.new(current_app.extensions['credential_cache_key'],
+                        message.encode('utf-8'), hashlib.sha256).digest()
+
+    def verify(self, user, password):
+        key = self.digest(user, password)
+        if user.id is not None and self.cache.get(key) == user.id:
+            return True
+        if not user.verify_password(password):
+            return False
+        self.cache.set(key, user.id)
+        return True
+
+    def invalidate(self, user_id):
+        self.cache.delete_where(lambda cached_id: cached_id == user_id)
+
+
+class PrincipalCache(AppCache):
+    """Token-authenticated principals by user id, so that verifying a token
+    does not load the ``User`` row on every request.
+
+    Every user has a generation in the shared cache, bumped when their
+    password or role changes, and so do all users together, bumped when the
+    permissions of the roles change. A principal is only used while the
+    generations it was loaded at are current, so a change reaches every
+    worker at once.
+    """
+    name = 'principal_cache'
+    all_key = 'principals'
+
+    @staticmethod
+    def key(user_id):
+        return 'principal:{}'.format(user_id)
+
+    def generation(self):
+        """The generation of all users."""
+        return current_app.extensions['shared_cache'].get(self.all_key) or 0
+
+    def get(self, user_id):
+        """The cached principal of ``user_id`` if it is current, or
+        ``None``, and the generations of the user."""
+        generation = tuple(
+            value or 0 for value in
+            current_app.extensions['shared_cache'].get_many(
+                [self.key(user_id), self.all_key]))
+        entry = self.cache.get(user_id)
+        if entry is None or entry[1] != generation:
+            return None, generation
+        return entry[0], generation
+
+    def set(self, principal, generation):
+        """Cache ``principal``, loaded after reading ``generation``."""
+        self.cache.set(principal.id, (principal, generation))
+
+    def invalidate(self, user_id=None):
+        """Drop the principal of ``user_id``, or of every user, in every
+        worker."""
+        if user_id is None:
+            self.cache.clear()
+            current_app.extensions['shared_cache'].incr(self.all_key)
+            return
+        self.cache.delete(user_id)
+        current_app.extensions['shared_cache'].incr(self.key(user_id))
+
+
+class UnknownUserCache(AppCache):
+    """Remembers usernames and emails that no user has, so that logins with
+    them, like brute-force attempts, stop reaching the database.
+
+    Entries are kept by each worker with the generation of the users in the
+    shared cache, which is bumped whenever a user takes a username or email,
+    so every worker finds the new user at once.
+    """
+    name = 'unknown_user_cache'
+    key = 'users'
+
+    def get(self, name_or_email):
+        """Whether ``name_or_email`` is known to be unknown, and the
+        generation of the users."""
+        generation = current_app.extensions['shared_cache'].get(
+            self.key) or 0
+        return self.cache.get(name_or_email) == generation, generation
+
+    def add(self, name_or_email, generation):
+        """Remember ``name_or_email``, found unknown after reading
+        ``generation``."""
+        self.cache.set(name_or_email, generation)
+
+    def invalidate(self):
+        self.cache.clear()
+        current_app.extensions['shared_cache'].incr(self.key)
+
+
+class CacheBackend(object):
+    """Storage behind :class:`ResponseCache`.
+
+    Cached values are plain tuples, so a backend shared between worker
+    processes (memcached, redis, ...) only has to pickle them. Entries may be
+    evicted at any time; the counters behind ``incr`` must be atomic across
+    every worker sharing the backend.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class SQLiteStore(object):
+    """A SQLite file for the processes of one host, created with the
+    ``schema`` statements.
+
+    Each process and thread opens its own connection.
+    """
+    schema = []
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            for statement in self.schema:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+
+class LRUBackend(CacheBackend):
+    """An in-process backend, private to each worker.
+
+    It holds at most ``maxsize`` entries and as many counters. Evicting a
+    counter restarts it from 0, which could make entries stored under its
+    old values current again, so the entries are dropped along with it.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = TTLCache(maxsize=maxsize)
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+        return self._entries.get(key)
+
+    def set(self, key, value, timeout=None):
+        self._entries.set(key, value, ttl=timeout)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters.pop(key, 0) + 1
+            self._counters[key] = value
+            if len(self._counters) > max(self.maxsize, 1):
+                self._counters.popitem(last=False)
+                self._entries.clear()
+            return value
+
+    def clear(self):
+        self._entries.clear()
+        with self._lock:
+            self._counters.clear()
+
+
+class SQLiteBackend(SQLiteStore, CacheBackend):
+    """A backend in a SQLite file, shared by the workers of a host."""
+    schema = ['CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+              'value BLOB NOT NULL, expires REAL)']
+
+    def __init__(self, path, timer=time.time):
+        super(SQLiteBackend, self).__init__(path)
+        self.timer = timer
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        rows = self.connection.execute(
+            'SELECT key, value, expires FROM entries WHERE key IN ({})'
+            .format(', '.join('?' * len(keys))), keys).fetchall()
+        now = self.timer()
+        values = {key: pickle.loads(value) for key, value, expires in rows
+                  if expires is None or expires > now}
+        return [values.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        now = self.timer()
+        connection = self.connection
+        connection.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+            (key, pickle.dumps(value), now + timeout if timeout else None))
+        if random.randrange(SQLITE_PRUNE_EVERY) == 0:
+            connection.execute('DELETE FROM entries WHERE expires < ?',
+                               (now,))
+
+    def incr(self, key):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            value = (pickle.loads(row[0]) if row is not None else 0) + 1
+            connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, NULL)',
+                (key, pickle.dumps(value)))
+        finally:
+            connection.execute('COMMIT')
+        return value
+
+    def clear(self):
+        self.connection.execute('DELETE FROM entries')
+
+
+def create_backend(app, prefix):
+    """The :class:`CacheBackend` configured by ``<prefix>_BACKEND``:
+    ``None`` (none), ``'lru'`` (private to each worker, holding
+    ``<prefix>_SIZE`` entries), ``'sqlite'`` (a file at
+    ``<prefix>_SQLITE_PATH`` shared by the workers of a host), or a factory
+    (or its import path) called with the app."""
+    factory = app.config[prefix + '_BACKEND']
+    if factory is None:
+        return None
+    if factory == 'lru':
+        return LRUBackend(app.config[prefix + '_SIZE'])
+    if factory == 'sqlite':
+        return SQLiteBackend(app.config[prefix + '_SQLITE_PATH'])
+    if isinstance(factory, str):
+        factory = import_string(factory)
+    return factory(app)
+
+
+class SharedCache(object):
+    """The :class:`CacheBackend` of state that every worker must see at
+    once, set by ``SHARED_CACHE_BACKEND`` (see :func:`create_backend`).
+
+    ``'lru'`` is only shared within one process; deployments running several
+    workers use ``'sqlite'`` or a memcached or redis factory.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = create_backend(app, 'SHARED_CACHE')
+        if backend is None:
+            raise ValueError('SHARED_CACHE_BACKEND must be set')
+        app.extensions['shared_cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['shared_cache']
+
+
+class ResponseCache(object):
+    """Caches the responses of anonymous GET requests.
+
+    Views are tagged with the resources they show, and writes invalidate
+    those tags. Every tag has a generation counter that is part of the cache
+    key, so bumping it makes exactly the entries stored under the tag
+    unreachable; they then age out of the backend. The generations are kept
+    in the shared cache, so that a write, or a ``flask`` command run outside
+    the workers, invalidates the entries of every worker.
+
+    ``RESPONSE_CACHE_BACKEND`` is ``None`` (off) or a backend of
+    :func:`create_backend`.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['response_cache'] = {}
+
+    @property
+    def backend(self):
+        state = current_app.extensions['response_cache']
+        if 'backend' not in state:
+            state.setdefault('backend', self.create_backend(current_app))
+        return state['backend']
+
+    @staticmethod
+    def create_backend(app):
+        return create_backend(app, 'RESPONSE_CACHE')
+
+    @staticmethod
+    def auth_class():
+        if g.current_user.is_anonymous:
+            return 'anonymous'
+        return 'token' if g.get('token_used') else 'basic'
+
+    def make_key(self, tags):
+        generations = current_app.extensions['shared_cache'].get_many(
+            ['tag:' + tag for tag in tags])
+        args = url_encode(sorted(request.args.items(multi=True)))
+        raw = '|'.join([request.host, request.path, args, self.auth_class()] +
+                       [str(generation or 0) for generation in generations])
+        return 'response:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def cached(self, *tags):
+        """Cache a view under ``tags``, formatted with the view arguments."""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                backend = self.backend
+                if backend is None or request.method != 'GET' or \
+                        not g.current_user.is_anonymous:
+                    return f(*args, **kwargs)
+                key = self.make_key([tag.format(**kwargs) for tag in tags])
+                entry = backend.get(key)
+                if entry is not None:
+                    status, headers, data = entry
+                    response = current_app.response_class(
+                        data, status=status, headers=headers)
+                    return response.make_conditional(request)
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    timeout = current_app.config['RESPONSE_CACHE_TIMEOUT']
+                    if g.get('db_replica_read'):
+                        # a lagging replica may miss the write that bumped
+                        # the tags; keep the page no longer than the lag
+                        timeout = min(timeout, current_app.config[
+                            'SQLALCHEMY_REPLICA_STICKINESS'])
+                    backend.set(key, (response.status_code,
+                                      list(response.headers),
+                                      response.get_data()), timeout=timeout)
+                return response
+            return decorated_function
+        return decorator
+
+    def invalidate(self, *tags):
+        if self.backend is None:
+            return
+        shared_cache = current_app.extensions['shared_cache']
+        for tag in tags:
+            shared_cache.incr('tag:' + tag)
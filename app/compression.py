@@ -0,0 +1,78 @@
+import zlib
+from flask import request
+from flask import current_app
+
+from .instrumentation import timer
+
+# wbits of each supported content coding
+CODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class Compression(object):
+    """Compresses responses for clients that accept gzip or deflate.
+
+    Only ``COMPRESS_MIMETYPES`` responses of at least ``COMPRESS_MIN_SIZE``
+    bytes are compressed; streamed responses are compressed as they are
+    sent, whatever their size. Compressed responses get a weak ETag, which
+    still matches ``If-None-Match`` but not as a byte-for-byte validator.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.compress)
+
+    @staticmethod
+    def negotiate():
+        """The accepted content coding, preferring gzip on equal quality."""
+        best, best_quality = None, 0
+        for coding in ('gzip', 'deflate'):
+            quality = request.accept_encodings[coding]
+            if quality > best_quality:
+                best, best_quality = coding, quality
+        return best
+
+    def compress(self, response):
+        config = current_app.config
+        if response.mimetype not in config['COMPRESS_MIMETYPES']:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not 200 <= response.status_code < 300 or \
+                response.status_code == 204 or \
+                response.direct_passthrough or \
+                'Content-Encoding' in response.headers:
+            return response
+        coding = self.negotiate()
+        if coding is None:
+            return response
+        compressor = zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED,
+                                      CODINGS[coding])
+        if response.is_streamed:
+            response.response = self.compress_stream(
+                compressor, response.iter_encoded())
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            with timer('compress'):
+                response.set_data(
+                    compressor.compress(data) + compressor.flush())
+        response.headers['Content-Encoding'] = coding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    @staticmethod
+    def compress_stream(compressor, chunks):
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
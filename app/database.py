@@ -0,0 +1,327 @@
+"""The ``SQLAlchemy`` extension, with connection pool settings and metrics.
+
+On top of the pool keys Flask-SQLAlchemy reads (``SQLALCHEMY_POOL_SIZE``,
+``SQLALCHEMY_MAX_OVERFLOW``, ``SQLALCHEMY_POOL_TIMEOUT`` and
+``SQLALCHEMY_POOL_RECYCLE``):
+
+``SQLALCHEMY_POOL_PRE_PING``
+    test connections with ``SELECT 1`` on checkout, replacing dead ones
+    (after a database restart or failover) before a request gets them.
+``SQLALCHEMY_STATEMENT_TIMEOUT``
+    milliseconds after which a statement is cancelled; ``statement_timeout``
+    on Postgres, a progress handler on SQLite.
+``SQLALCHEMY_REPLICA_URIS``
+    read replicas of the primary database. Views decorated with
+    :meth:`Database.read_replica` run their queries on one of them, except
+    for a client that wrote less than ``SQLALCHEMY_REPLICA_STICKINESS``
+    seconds ago, which keeps reading from the primary. The writers are
+    remembered in the shared cache, so every worker knows them.
+"""
+import time
+import random
+import threading
+from functools import wraps
+from flask import g
+from flask import request
+from flask import has_app_context
+from flask import has_request_context
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy import orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+
+# SQLite virtual machine instructions between statement deadline checks
+SQLITE_PROGRESS_STEPS = 10000
+
+
+class PoolMetrics(object):
+    """Counters of a connection pool, kept across ``dispose()``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, elapsed, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_time += elapsed
+            self.max_wait = max(self.max_wait, elapsed)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_json(self, pool):
+        with self._lock:
+            json_metrics = {
+                'pool': type(pool).__bases__[-1].__name__,
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_time': self.wait_time,
+                'max_wait': self.max_wait,
+                'mean_wait': self.wait_time / self.checkouts
+                if self.checkouts else 0.0,
+            }
+        # only queue pools have a size and overflow
+        for name, method in [('size', 'size'),
+                             ('checked_in', 'checkedin'),
+                             ('checked_out', 'checkedout'),
+                             ('overflow', 'overflow')]:
+            if hasattr(pool, method):
+                json_metrics[name] = getattr(pool, method)()
+        return json_metrics
+
+
+class MeteredPool(object):
+    """Mixed into the pool class of each engine to time checkouts."""
+
+    def __init__(self, *args, **kwargs):
+        super(MeteredPool, self).__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        pool = super(MeteredPool, self).recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super(MeteredPool, self)._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+_metered_classes = {}
+
+
+def metered(poolclass):
+    if issubclass(poolclass, MeteredPool):
+        return poolclass
+    if poolclass not in _metered_classes:
+        _metered_classes[poolclass] = type(
+            'Metered' + poolclass.__name__, (MeteredPool, poolclass), {})
+    return _metered_classes[poolclass]
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception:
+        # the pool retries the checkout with a new connection
+        raise exc.DisconnectionError()
+
+
+def sqlite_statement_timeout(engine, timeout):
+    def on_connect(dbapi_connection, connection_record):
+        deadline = connection_record.info['statement_deadline'] = [None]
+
+        def expired():
+            return deadline[0] is not None and time.monotonic() > deadline[0]
+
+        dbapi_connection.set_progress_handler(expired, SQLITE_PROGRESS_STEPS)
+
+    def before_execute(conn, cursor, statement, parameters, context,
+                       executemany):
+        deadline = conn.info.get('statement_deadline')
+        if deadline is not None:
+            deadline[0] = time.monotonic() + timeout / 1000.0
+
+    def after_execute(conn, cursor, statement, parameters, context,
+                      executemany):
+        deadline = conn.info.get('statement_deadline')
+        if deadline is not None:
+            deadline[0] = None
+
+    def on_error(context):
+        if context.connection is not None:
+            after_execute(context.connection, None, None, None, None, None)
+
+    event.listen(engine, 'connect', on_connect)
+    event.listen(engine, 'before_cursor_execute', before_execute)
+    event.listen(engine, 'after_cursor_execute', after_execute)
+    event.listen(engine, 'handle_error', on_error)
+
+
+def writer_key():
+    """The client of the current request: its user, or its address when it
+    is anonymous."""
+    user = g.get('current_user')
+    if user is not None and not user.is_anonymous:
+        return 'user:{}'.format(user.id)
+    if has_request_context():
+        return 'addr:{}'.format(request.remote_addr)
+    return None
+
+
+class RoutingSession(SignallingSession):
+    """Runs the queries of replica-reading views on the chosen replica.
+
+    Pending changes, flushes and models with their own ``__bind_key__``
+    still go to their engine, and a commit after any write makes the writer
+    sticky to the primary.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and not self._flushing and \
+                not (self.new or self.dirty or self.deleted) and \
+                (mapper is None or
+                 mapper.mapped_table.info.get('bind_key') is None):
+            return self.db.get_engine(self.app, bind=replica)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def execute(self, clause, *args, **kwargs):
+        if isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        return super(RoutingSession, self).execute(clause, *args, **kwargs)
+
+    def commit(self):
+        wrote = self.info.pop('wrote', False) or \
+            bool(self.new or self.dirty or self.deleted)
+        super(RoutingSession, self).commit()
+        if wrote and has_app_context():
+            self.db.stick_to_primary()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def record_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+class Database(SQLAlchemy):
+    def init_app(self, app):
+        uris = app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_STICKINESS', 5)
+        # replicas are binds, so they get the same engine options
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for i, uri in enumerate(uris):
+            binds['replica{}'.format(i)] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        super(Database, self).init_app(app)
+        app.extensions['db_replicas'] = {
+            'binds': ['replica{}'.format(i) for i in range(len(uris))],
+        }
+        try:
+            import uwsgi
+        except ImportError:
+            return
+
+        # connections opened while loading the app must not be shared
+        # between uWSGI workers. The hook is chained by hand, as
+        # uwsgidecorators cannot be imported without a master process.
+        post_fork_hook = getattr(uwsgi, 'post_fork_hook', None)
+
+        def dispose_engine():
+            if post_fork_hook is not None:
+                post_fork_hook()
+            with app.app_context():
+                self.get_engine(app).dispose()
+
+        uwsgi.post_fork_hook = dispose_engine
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def choose_replica(self):
+        """The bind of a replica for the current request, or ``None`` for
+        the primary."""
+        app = self.get_app()
+        binds = app.extensions['db_replicas']['binds']
+        if not binds:
+            return None
+        key = writer_key()
+        if key is not None and \
+                app.extensions['shared_cache'].get('sticky:' + key):
+            return None
+        return random.choice(binds)
+
+    def stick_to_primary(self):
+        """Read from the primary for the next requests of the writer, in
+        every worker."""
+        key = writer_key()
+        if key is not None:
+            app = self.get_app()
+            app.extensions['shared_cache'].set(
+                'sticky:' + key, True,
+                timeout=app.config['SQLALCHEMY_REPLICA_STICKINESS'])
+
+    def read_replica(self, f):
+        """Run the queries of a view on a replica when there is one.
+
+        ``g.db_replica_read`` is then set for the rest of the request, e.g.
+        for a cache to keep the response no longer than the replica may lag.
+        """
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.db_replica = self.choose_replica()
+            if g.db_replica is not None:
+                g.db_replica_read = True
+            try:
+                return f(*args, **kwargs)
+            finally:
+                g.pop('db_replica', None)
+        return decorated_function
+
+    def apply_driver_hacks(self, app, info, options):
+        super(Database, self).apply_driver_hacks(app, info, options)
+        timeout = app.config['SQLALCHEMY_STATEMENT_TIMEOUT']
+        if timeout and info.drivername.startswith('postgresql'):
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = '-c statement_timeout={:d}'.format(
+                timeout)
+        poolclass = options.get('poolclass') or \
+            info.get_dialect().get_pool_class(info)
+        if not issubclass(poolclass, QueuePool):
+            # e.g. the NullPool of SQLite files, which takes no sizes
+            for name in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(name, None)
+        options['poolclass'] = metered(poolclass)
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(Database, self).get_engine(app, bind)
+        if not getattr(engine, 'pool_listeners_added', False):
+            with self._engine_lock:
+                if not getattr(engine, 'pool_listeners_added', False):
+                    self.add_pool_listeners(self.get_app(app), engine)
+                    engine.pool_listeners_added = True
+        return engine
+
+    @staticmethod
+    def add_pool_listeners(app, engine):
+        event.listen(engine, 'connect',
+                     lambda *args: engine.pool.metrics.count('connects'))
+        event.listen(engine, 'invalidate',
+                     lambda *args: engine.pool.metrics.count('invalidations'))
+        if app.config['SQLALCHEMY_POOL_PRE_PING']:
+            event.listen(engine, 'checkout', ping_connection)
+        timeout = app.config['SQLALCHEMY_STATEMENT_TIMEOUT']
+        if timeout and engine.dialect.name == 'sqlite':
+            sqlite_statement_timeout(engine, timeout)
+
+    def pool_metrics(self, app=None, bind=None):
+        pool = self.get_engine(app, bind).pool
+        return pool.metrics.to_json(pool)
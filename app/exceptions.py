@@ -8,3 +8,9 @@ class ValidationError(ValueError):
 
 class ForbiddenError(Exception):
     pass
+
+
+class TooManyRequestsError(Exception):
+    def __init__(self, message, retry_after):
+        super(TooManyRequestsError, self).__init__(message)
+        self.retry_after = retry_after
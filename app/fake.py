@@ -0,0 +1,105 @@
+"""Fake users and posts for development, tests and load testing.
+
+Rows are inserted with executemany in batches, one transaction per batch.
+Passing a ``seed`` makes the dataset reproducible. Post bodies are drawn
+from a pool of ``BODY_POOL_SIZE`` bodies, so that Markdown is rendered once
+per body rather than once per post.
+"""
+import random
+from datetime import datetime
+from datetime import timedelta
+from werkzeug.security import generate_password_hash
+import forgery_py
+
+from . import db
+from .models import Role
+from .models import User
+from .models import Post
+from .rendering import render_markdown
+from .rendering import body_digest
+
+BODY_POOL_SIZE = 1000
+# posts are dated within DATE_SPAN before DATE_EPOCH, not before today, so
+# that a seeded dataset is the same whenever it is generated
+DATE_EPOCH = datetime(2017, 1, 1)
+DATE_SPAN = timedelta(days=20)
+
+
+def batches(count, batch_size):
+    for start in range(0, count, batch_size):
+        yield start, min(batch_size, count - start)
+
+
+def generate_users(count, password='password', batch_size=1000,
+                   progress=None):
+    """Insert ``count`` users, all with the same ``password``.
+
+    The password is hashed once for the whole run.
+    """
+    password_hash = generate_password_hash(password)
+    role_id = Role.registry().default_id
+    offset = db.session.query(db.func.max(User.id)).scalar() or 0
+    for start, size in batches(count, batch_size):
+        rows = []
+        for i in range(offset + start + 1, offset + start + size + 1):
+            # not internet.user_name(), whose first_name() grows a cached
+            # dictionary on every call
+            name = forgery_py.name.last_name().lower()
+            rows.append({
+                'username': '{}.{}'.format(name, i),
+                'email': '{}.{}@{}'.format(
+                    name, i, forgery_py.internet.domain_name()),
+                'role_id': role_id,
+                'password_hash': password_hash,
+            })
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+        if progress is not None:
+            progress('users', start + size, count)
+
+
+def generate_posts(count, batch_size=1000, progress=None):
+    """Insert ``count`` posts by random existing users."""
+    author_ids = [user_id for user_id, in db.session.query(User.id)]
+    if not author_ids:
+        raise ValueError('Cannot generate posts without users')
+    bodies = []
+    for i in range(min(count, BODY_POOL_SIZE)):
+        body = forgery_py.lorem_ipsum.paragraphs()
+        bodies.append({'body': body,
+                       'body_html': render_markdown(body),
+                       'body_html_digest': body_digest(body)})
+    numbers = {}
+    for start, size in batches(count, batch_size):
+        rows = []
+        for i in range(size):
+            created_at = DATE_EPOCH - timedelta(seconds=random.randrange(
+                int(DATE_SPAN.total_seconds())))
+            row = dict(random.choice(bodies),
+                       title=forgery_py.lorem_ipsum.title(),
+                       created_at=created_at,
+                       updated_at=created_at,
+                       author_id=random.choice(author_ids))
+            rows.append(row)
+        slugs = Post.allocate_slugs([row['title'] for row in rows], numbers)
+        counts = {}
+        for row, slug in zip(rows, slugs):
+            row['slug'] = slug
+            count, latest = counts.get(row['author_id'], (0, None))
+            counts[row['author_id']] = (count + 1, max(
+                latest or row['created_at'], row['created_at']))
+        db.session.execute(Post.__table__.insert(), rows)
+        User.count_posts(db.session, counts)
+        db.session.commit()
+        if progress is not None:
+            progress('posts', start + size, count)
+
+
+def generate(users, posts, seed=None, password='password', batch_size=1000,
+             progress=None):
+    if seed is not None:
+        random.seed(seed)
+    if Role.query.first() is None:
+        Role.insert_roles()
+    generate_users(users, password, batch_size, progress)
+    generate_posts(posts, batch_size, progress)
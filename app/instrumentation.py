@@ -0,0 +1,173 @@
+"""Per-request timings, slow request and query logs, and latency metrics.
+
+Each request is split into phases: ``auth``, ``serialize`` and
+``compress`` are timed where they happen (see :func:`timer`), ``db`` adds
+up the statements Flask-SQLAlchemy records when ``SQLALCHEMY_RECORD_QUERIES``
+is on, and ``handler`` is whatever follows authentication. The phases are
+sent back in a ``Server-Timing`` header (``SERVER_TIMING``), requests
+slower than ``SLOW_REQUEST_MS`` and statements slower than ``SLOW_QUERY_MS``
+are logged as warnings, and every request feeds the per-endpoint counters
+and histograms of :meth:`Instrumentation.to_json`.
+
+The counters are kept by each worker process.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g
+from flask import request
+from flask import current_app
+from flask import has_app_context
+from flask_sqlalchemy import get_debug_queries
+
+# upper bounds, in milliseconds, of the latency histogram buckets
+LATENCY_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in the block (or decorated function) to the
+    ``name`` phase of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_app_context() and 'timings' in g:
+            timings = g.timings
+            timings[name] = timings.get(name, 0.0) + \
+                (time.perf_counter() - start) * 1000
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_json(self):
+        """Cumulative counts by upper bound, as Prometheus has them."""
+        buckets, total = {}, 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            buckets[str(bound)] = total
+        return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+class EndpointMetrics(object):
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram()
+        self.queries = 0
+        self.db_time = 0.0
+
+    def to_json(self):
+        return {
+            'count': self.latency.count,
+            'statuses': dict(self.statuses),
+            'latency': self.latency.to_json(),
+            'queries': self.queries,
+            'db_time': self.db_time,
+        }
+
+
+class Instrumentation(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['instrumentation'] = {
+            'lock': threading.Lock(),
+            'endpoints': {},
+            'queries': Histogram(),
+            'slow_requests': 0,
+            'slow_queries': 0,
+        }
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    @staticmethod
+    def start_request():
+        g.request_start = time.perf_counter()
+        g.timings = {}
+        # tests reuse one app context, and its queries, for many requests
+        g.queries_before = len(get_debug_queries())
+
+    def finish_request(self, response):
+        if 'timings' not in g:
+            return response
+        timings = g.timings
+        total = (time.perf_counter() - g.request_start) * 1000
+        timings['handler'] = total - timings.get('auth', 0.0)
+        timings['total'] = total
+        config = current_app.config
+        queries = get_debug_queries()[g.queries_before:]
+        durations = [query.duration * 1000 for query in queries]
+        if queries:
+            timings['db'] = sum(durations)
+        slow_queries = [
+            (query, duration) for query, duration in zip(queries, durations)
+            if duration >= config['SLOW_QUERY_MS']]
+        for query, duration in slow_queries:
+            current_app.logger.warning(
+                'Slow query (%.1f ms) at %s: %s', duration, query.context,
+                query.statement)
+        slow_request = total >= config['SLOW_REQUEST_MS']
+        if slow_request:
+            current_app.logger.warning(
+                'Slow request (%.1f ms) %s %s -> %d: %s', total,
+                request.method, request.full_path.rstrip('?'),
+                response.status_code, self.format_timings(timings, queries))
+        self.record(request.endpoint or '<unmatched>', response.status_code,
+                    timings, durations, slow_request, len(slow_queries))
+        if config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = self.format_timings(
+                timings, queries)
+        return response
+
+    @staticmethod
+    def format_timings(timings, queries):
+        metrics = []
+        for name in sorted(timings):
+            metric = '{};dur={:.1f}'.format(name, timings[name])
+            if name == 'db':
+                metric += ';desc="{} queries"'.format(len(queries))
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+    @staticmethod
+    def record(endpoint, status_code, timings, durations, slow_request,
+               slow_queries):
+        state = current_app.extensions['instrumentation']
+        status = '{}xx'.format(status_code // 100)
+        with state['lock']:
+            metrics = state['endpoints'].get(endpoint)
+            if metrics is None:
+                metrics = state['endpoints'][endpoint] = EndpointMetrics()
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.latency.observe(timings['total'])
+            metrics.queries += len(durations)
+            metrics.db_time += timings.get('db', 0.0)
+            for duration in durations:
+                state['queries'].observe(duration)
+            state['slow_requests'] += slow_request
+            state['slow_queries'] += slow_queries
+
+    @staticmethod
+    def to_json():
+        state = current_app.extensions['instrumentation']
+        with state['lock']:
+            return {
+                'endpoints': {endpoint: metrics.to_json() for endpoint, metrics
+                              in state['endpoints'].items()},
+                'queries': state['queries'].to_json(),
+                'slow_requests': state['slow_requests'],
+                'slow_queries': state['slow_queries'],
+            }
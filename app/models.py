@@ -1,15 +1,30 @@
+import re
+import hashlib
 from datetime import datetime
+from itertools import islice
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor
 from slugify import slugify
-from flask import url_for
 from flask import current_app
-from sqlalchemy.orm.base import NO_VALUE
-from sqlalchemy.orm.base import NEVER_SET
+from flask import has_app_context
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash
 from werkzeug.security import check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
 from . import db
+from . import credential_cache
+from . import principal_cache
+from . import unknown_user_cache
 from .exceptions import ValidationError
+from .rendering import render_markdown
+from .rendering import body_digest
+from .serialization import external_url
+from .serialization import format_datetime
+from .search import match
+from .search import search_terms
+from .search import create_search_index
+from .search import drop_search_index
 
 
 class Permission:
@@ -20,6 +35,27 @@ class Permission:
     ADMINISTER = 0x80
 
 
+class RoleRegistry(object):
+    """Role permissions by role id, loaded once per application so that
+    permission checks are integer operations.
+
+    The registry is reloaded when the generation of all principals, which
+    ``Role.insert_roles`` bumps, is no longer ``generation``.
+    """
+
+    def __init__(self, rows, generation=0):
+        self.generation = generation
+        self.permissions = {}
+        self.default_id = None
+        self.administrator_id = None
+        for role_id, permissions, default in rows:
+            self.permissions[role_id] = permissions or 0
+            if default:
+                self.default_id = role_id
+            if permissions == 0xff:
+                self.administrator_id = role_id
+
+
 class Role(db.Model):
     __tablename__ = 'roles'
     id = db.Column(db.Integer, primary_key=True)
@@ -43,6 +79,33 @@ class Role(db.Model):
             role.default = roles[r][1]
             db.session.add(role)
         db.session.commit()
+        # cached principals carry the old permissions, in every worker
+        principal_cache.invalidate()
+        Role.load_registry()
+
+    @staticmethod
+    def load_registry():
+        generation = principal_cache.generation()
+        registry = RoleRegistry(db.session.query(
+            Role.id, Role.permissions, Role.default), generation)
+        current_app.extensions['role_registry'] = registry
+        return registry
+
+    @staticmethod
+    def registry():
+        registry = current_app.extensions.get('role_registry')
+        if registry is None or not registry.permissions or \
+                registry.generation != principal_cache.generation():
+            registry = Role.load_registry()
+        return registry
+
+    @staticmethod
+    def permissions_for(role_id):
+        permissions = Role.registry().permissions.get(role_id)
+        if permissions is None:
+            # a role added since the registry was loaded
+            permissions = Role.load_registry().permissions.get(role_id, 0)
+        return permissions
 
     def __repr__(self):
         return '<Role %r>' % self.name
@@ -55,23 +118,38 @@ class User(db.Model):
     email = db.Column(db.String(64), unique=True, index=True)
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
     password_hash = db.Column(db.String(128))
+    # kept up to date by the Post mapper events; see User.count_posts
+    post_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    last_post_at = db.Column(db.DateTime)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     is_anonymous = False
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        if self.role is None:
+        if self.role is None and self.role_id is None:
+            registry = Role.registry()
+            role_id = None
             if self.email == current_app.config['ADMIN_EMAIL']:
-                self.role = Role.query.filter_by(permissions=0xff).first()
-            if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+                role_id = registry.administrator_id
+            if role_id is None:
+                role_id = registry.default_id
+            self.role_id = role_id
 
     def __repr__(self):
         return '<User %r>' % self.username
 
+    @property
+    def permissions(self):
+        if self.role_id is not None:
+            return Role.permissions_for(self.role_id)
+        if self.role is not None:
+            # a new user whose role is not flushed yet
+            return self.role.permissions
+        return 0
+
     def can(self, permissions):
-        return self.role is not None and \
-            (self.role.permissions & permissions) == permissions
+        return (self.permissions & permissions) == permissions
 
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
@@ -87,44 +165,192 @@ class User(db.Model):
     def verify_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @staticmethod
+    def find_by_login(name_or_email):
+        """The user with ``name_or_email`` as username or email, found with
+        a single query on the two unique indexes."""
+        unknown, generation = unknown_user_cache.get(name_or_email)
+        if unknown:
+            return None
+        users = User.query.filter(db.or_(User.username == name_or_email,
+                                         User.email == name_or_email)) \
+            .limit(2).all()
+        if not users:
+            unknown_user_cache.add(name_or_email, generation)
+            return None
+        # a username match wins, as when usernames were looked up first
+        users.sort(key=lambda user: user.username != name_or_email)
+        return users[0]
+
+    @staticmethod
+    def on_changed_login(target, value, oldvalue, initiator):
+        if value is not None and has_app_context():
+            unknown_user_cache.invalidate()
+
+    @staticmethod
+    def count_posts(connection, counts):
+        """Add to the post counters of authors, in the transaction of
+        ``connection`` (or session).
+
+        ``counts`` maps author ids to ``(added, created_at)``, where
+        ``created_at`` is the newest added post, or ``None`` when posts were
+        removed and the latest post has to be looked up again.
+        """
+        users = User.__table__
+        posts = Post.__table__
+        added, removed = [], []
+        for author_id, (count, created_at) in counts.items():
+            if author_id is None or not count:
+                continue
+            params = {'author_id': author_id, 'count': count,
+                      'created_at': created_at}
+            (added if created_at is not None else removed).append(params)
+        where = users.c.id == db.bindparam('author_id')
+        post_count = users.c.post_count + db.bindparam('count')
+        if added:
+            created_at = db.bindparam('created_at', type_=db.DateTime)
+            connection.execute(users.update().where(where).values(
+                post_count=post_count,
+                last_post_at=db.case(
+                    [(db.or_(users.c.last_post_at.is_(None),
+                             users.c.last_post_at < created_at),
+                      created_at)],
+                    else_=users.c.last_post_at)), added)
+        if removed:
+            connection.execute(users.update().where(where).values(
+                post_count=post_count,
+                last_post_at=db.select([db.func.max(posts.c.created_at)])
+                .where(posts.c.author_id == users.c.id).as_scalar()),
+                removed)
+
+    @staticmethod
+    def recount(batch_size=1000):
+        """Rebuild the post counters of every user from the posts.
+
+        Users are checked in batches by id; only the rows that drifted are
+        written. Yields ``(checked, usernames)`` with the users corrected in
+        each batch.
+        """
+        posts = Post.__table__
+        update = User.__table__.update() \
+            .where(User.id == db.bindparam('user_id')) \
+            .values(post_count=db.bindparam('count'),
+                    last_post_at=db.bindparam('created_at'))
+        last_id = 0
+        while True:
+            users = db.session.query(
+                User.id, User.username, User.post_count, User.last_post_at) \
+                .filter(User.id > last_id) \
+                .order_by(User.id).limit(batch_size).all()
+            if not users:
+                return
+            last_id = users[-1].id
+            stats = dict(
+                (author_id, (count, created_at))
+                for author_id, count, created_at in db.session.query(
+                    posts.c.author_id, db.func.count(),
+                    db.func.max(posts.c.created_at))
+                .filter(posts.c.author_id.in_([user.id for user in users]))
+                .group_by(posts.c.author_id))
+            params = []
+            usernames = []
+            for user in users:
+                count, created_at = stats.get(user.id, (0, None))
+                if (count, created_at) != (user.post_count,
+                                           user.last_post_at):
+                    params.append({'user_id': user.id, 'count': count,
+                                   'created_at': created_at})
+                    usernames.append(user.username)
+            if params:
+                db.session.execute(update, params)
+            db.session.commit()
+            yield len(users), usernames
+
+    @staticmethod
+    def on_changed_credentials(target, value, oldvalue, initiator):
+        if target.id is not None and has_app_context():
+            credential_cache.invalidate(target.id)
+            principal_cache.invalidate(target.id)
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        # a worker may have found the login unknown since it was set
+        db.object_session(target).info['changed_logins'] = True
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        principal_cache.invalidate(target.id)
+        # again once committed, in case another worker loaded the old row
+        # in between
+        session = db.object_session(target)
+        session.info.setdefault('changed_principals', set()).add(target.id)
+        session.info['changed_logins'] = True
+
+    @staticmethod
+    def on_committed(session):
+        if has_app_context():
+            for user_id in session.info.pop('changed_principals', ()):
+                principal_cache.invalidate(user_id)
+            if session.info.pop('changed_logins', False):
+                unknown_user_cache.invalidate()
+
+    @staticmethod
+    def auth_version(password_hash, role_id, permissions):
+        """A digest that changes whenever the password or role changes."""
+        key = '{}:{}:{}'.format(password_hash, role_id, permissions)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def version(self):
+        return User.auth_version(self.password_hash, self.role_id,
+                                 self.permissions)
+
     def generate_auth_token(self, expiration):
         s = Serializer(current_app.config['SECRET_KEY'],
                        expires_in=expiration)
-        return s.dumps({'id': self.id}).decode('ascii')
+        return s.dumps({
+            'id': self.id,
+            'username': self.username,
+            'permissions': self.permissions,
+            'version': self.version,
+        }).decode('ascii')
 
     @staticmethod
-    def verify_auth_token(token):
+    def load_auth_token(token):
         s = Serializer(current_app.config['SECRET_KEY'])
         try:
             data = s.loads(token)
         except:
             return None
-        return User.query.get(data['id'])
+        if not isinstance(data, dict) or 'version' not in data:
+            return None
+        return data
+
+    @staticmethod
+    def verify_auth_token(token):
+        data = User.load_auth_token(token)
+        if data is None:
+            return None
+        user = User.query.get(data['id'])
+        if user is None or user.version != data['version']:
+            return None
+        return user
 
     @staticmethod
     def generate_fake(count=100):
-        from sqlalchemy.exc import IntegrityError
-        from random import seed
-        import forgery_py
-
-        seed()
-        for i in range(count):
-            u = User(username=forgery_py.internet.user_name(True),
-                     email=forgery_py.internet.email_address(),
-                     password=forgery_py.lorem_ipsum.word(),
-                     )
-            db.session.add(u)
-            try:
-                db.session.commit()
-            except IntegrityError:
-                db.session.rollback()
+        from .fake import generate_users
+
+        generate_users(count)
 
     def to_json(self):
         json_user = {
-            'url': url_for('api.get_user', username=self.username, _external=True),
+            'url': external_url('api.get_user', username=self.username),
             'username': self.username,
             'email': self.email,
-            'posts': url_for('api.get_user_posts', username=self.username, _external=True),
+            'posts': external_url('api.get_user_posts',
+                                  username=self.username),
+            'post_count': self.post_count,
+            'last_post_at': format_datetime(self.last_post_at),
         }
         return json_user
 
@@ -136,7 +362,63 @@ class User(db.Model):
                     )
 
 
+class Principal(object):
+    """A token-authenticated user, carrying what authorization needs without
+    the ``User`` row."""
+    is_anonymous = False
+
+    def __init__(self, id, username, permissions, version):
+        self.id = id
+        self.username = username
+        self.permissions = permissions
+        self.version = version
+
+    def __repr__(self):
+        return '<Principal %r>' % self.username
+
+    def can(self, permissions):
+        return (self.permissions & permissions) == permissions
+
+    def is_administrator(self):
+        return self.can(Permission.ADMINISTER)
+
+    @staticmethod
+    def load(user_id):
+        row = db.session.query(User.id, User.username, User.password_hash,
+                               User.role_id) \
+            .filter(User.id == user_id).first()
+        if row is None:
+            return None
+        permissions = 0
+        if row.role_id is not None:
+            permissions = Role.permissions_for(row.role_id)
+        return Principal(row.id, row.username, permissions,
+                         User.auth_version(row.password_hash, row.role_id,
+                                           permissions))
+
+    @staticmethod
+    def from_token(token):
+        """Verify a token, loading the user only when it is not cached.
+
+        Tokens signed before a password or role change carry a stale
+        version and are rejected.
+        """
+        data = User.load_auth_token(token)
+        if data is None:
+            return None
+        principal, generation = principal_cache.get(data['id'])
+        if principal is None:
+            principal = Principal.load(data['id'])
+            if principal is None:
+                return None
+            principal_cache.set(principal, generation)
+        if principal.version != data['version']:
+            return None
+        return principal
+
+
 class AnonymousUser(object):
+    id = None
     is_anonymous = True
 
     def can(self, permissions):
@@ -152,76 +434,346 @@ class Post(db.Model):
     title = db.Column(db.Text)
     slug = db.Column(db.Text, index=True, unique=True)
     body = db.Column(db.Text)
+    body_html = db.Column(db.Text)
+    body_html_digest = db.Column(db.String(40))
     created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime,
                            default=datetime.utcnow,
                            onupdate=datetime.utcnow,
                            )
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # the old author is needed to move the post counters, see on_updated
+    author_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('users.id')), active_history=True)
+    __table_args__ = (
+        db.Index('ix_posts_author_id_created_at', 'author_id', 'created_at'),
+    )
+
+    # slugs taken by routes under /posts/
+    RESERVED_SLUGS = frozenset(['search'])
 
     @staticmethod
     def generate_fake(count=100):
-        from random import seed
-        from random import randint
-        import forgery_py
-
-        seed()
-        user_count = User.query.count()
-        for i in range(count):
-            u = User.query.offset(randint(0, user_count-1)).first()
-            p = Post(title=forgery_py.lorem_ipsum.title(),
-                     body=forgery_py.lorem_ipsum.paragraphs(),
-                     created_at=forgery_py.date.date(True),
-                     author=u,
-                     )
-            db.session.add(p)
-            db.session.commit()
+        from .fake import generate_posts
+
+        generate_posts(count)
 
     @staticmethod
     def slugify_title(text, separator='-', max_length=40):
-        slug = slugify(text,
+        return slugify(text,
                        separator=separator,
                        stopwords=['the', 'a', 'an'],
                        max_length=max_length,
                        word_boundary=True,
                        save_order=True,
                        )
-        counter = 2
-        new_slug = slug
-        while db.session.query(Post.query.filter_by(slug=new_slug).exists()).scalar():
-            new_slug = "{}{}{}".format(slug, separator, counter)
-            counter += 1
-        return new_slug
+
+    @staticmethod
+    def slug_matches(slug, base, separator='-'):
+        """Whether ``slug`` was allocated for ``base``: itself or numbered."""
+        if slug == base:
+            return True
+        prefix = base + separator
+        return slug.startswith(prefix) and slug[len(prefix):].isdigit()
+
+    @staticmethod
+    def slug_usage(base, separator='-'):
+        """Whether ``base`` is taken and the highest ``N`` of the ``base-N``
+        slugs taken, found in one query."""
+        prefix = base + separator
+        suffix = db.func.substr(Post.slug, len(prefix) + 1)
+        dialect = db.session.get_bind(mapper=Post.__mapper__).dialect.name
+        if dialect == 'postgresql':
+            numbered = Post.slug.op('~')('^' + re.escape(prefix) + '[0-9]+$')
+        elif dialect == 'sqlite':
+            # a range on the slug index; every digit sorts before ':'
+            numbered = db.and_(Post.slug > prefix, Post.slug < prefix + ':',
+                               db.not_(suffix.op('GLOB')('*[^0-9]*')))
+        else:
+            taken = [slug for slug, in db.session.query(Post.slug).filter(
+                db.or_(Post.slug == base, Post.slug.like(prefix + '%')))]
+            numbers = [int(slug[len(prefix):]) for slug in taken
+                       if slug != base and Post.slug_matches(slug, base)]
+            return base in taken, max(numbers) if numbers else None
+        base_taken, last = db.session.query(
+            db.func.max(db.case([(Post.slug == base, 1)], else_=0)),
+            db.func.max(db.case([(Post.slug == base, 1)],
+                                else_=db.cast(suffix, db.Integer)))) \
+            .filter(db.or_(Post.slug == base, numbered)).one()
+        return bool(base_taken), last
+
+    @staticmethod
+    def next_slug(base, separator='-'):
+        """The slug for a new post titled ``base``.
+
+        ``base`` is used while it is free; otherwise the next number past the
+        highest ``base-N`` taken.
+        """
+        base_taken, last = Post.slug_usage(base, separator)
+        if not base_taken and base not in Post.RESERVED_SLUGS:
+            return base
+        return '{}{}{}'.format(base, separator, max(last or 1, 1) + 1)
+
+    @staticmethod
+    def allocate_slugs(titles, numbers=None, separator='-'):
+        """Slugs for a batch of new posts.
+
+        One query finds which base slugs are taken; only bases that are
+        taken or repeated within the batch need their numbering looked up.
+        ``numbers`` maps bases to the last number allocated and may be kept
+        across batches to skip those lookups.
+        """
+        if numbers is None:
+            numbers = {}
+        bases = [Post.slugify_title(title) for title in titles]
+        lookup = set(bases) - set(numbers)
+        taken = set()
+        if lookup:
+            taken = set(slug for slug, in db.session.query(Post.slug).filter(
+                Post.slug.in_(lookup)))
+        taken.update(lookup & Post.RESERVED_SLUGS)
+        slugs = []
+        used = set()
+        for base in bases:
+            slug = base
+            if base in numbers or base in taken or base in used:
+                if base not in numbers:
+                    last = Post.slug_usage(base, separator)[1]
+                    numbers[base] = max(last or 1, 1)
+                numbers[base] += 1
+                slug = '{}{}{}'.format(base, separator, numbers[base])
+                while slug in taken or slug in used:
+                    numbers[base] += 1
+                    slug = '{}{}{}'.format(base, separator, numbers[base])
+            used.add(slug)
+            slugs.append(slug)
+        return slugs
 
     @staticmethod
     def title_to_slug(target, value, oldvalue, initiator):
-        old_slug = None
-        if oldvalue is not NO_VALUE and oldvalue is not NEVER_SET:
-            old_slug = Post.slugify_title(oldvalue)
-        new_slug = Post.slugify_title(value)
-        if value and not value == oldvalue and not old_slug == new_slug:
-            target.slug = new_slug
+        if not value or value == oldvalue:
+            return
+        base = Post.slugify_title(value)
+        if target.slug is not None and Post.slug_matches(target.slug, base):
+            return
+        target.slug = Post.next_slug(base)
 
-    def to_json(self):
-        json_post = {
-            'url': url_for('api.get_post', slug=self.slug, _external=True),
-            'title': self.title,
-            'body': self.body,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'author': url_for('api.get_user', username=self.author.username, _external=True),
-        }
-        return json_post
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        User.count_posts(connection,
+                         {target.author_id: (1, target.created_at)})
+        Post.expire_authors(target, [target.author_id])
 
     @staticmethod
-    def from_json(json_post):
+    def on_deleted(mapper, connection, target):
+        User.count_posts(connection, {target.author_id: (-1, None)})
+        Post.expire_authors(target, [target.author_id])
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        history = db.inspect(target).attrs.author_id.history
+        if not history.deleted:
+            return
+        counts = {author_id: (-1, None) for author_id in history.deleted}
+        counts.update((author_id, (1, target.created_at))
+                      for author_id in history.added)
+        User.count_posts(connection, counts)
+        Post.expire_authors(target, counts)
+
+    @staticmethod
+    def expire_authors(target, author_ids):
+        """Make loaded authors read their updated counters again."""
+        session = db.object_session(target)
+        for author_id in author_ids:
+            author = session.identity_map.get(
+                db.inspect(User).identity_key_from_primary_key([author_id]))
+            if author is not None:
+                session.expire(author, ['post_count', 'last_post_at'])
+
+    @staticmethod
+    def on_changed_body(target, value, oldvalue, initiator):
+        digest = body_digest(value)
+        if target.body_html_digest == digest:
+            return
+        target.body_html = render_markdown(value)
+        target.body_html_digest = digest
+
+    @staticmethod
+    def rerender(batch_size=500, processes=None, force=False):
+        """Render again the posts whose HTML is stale, or all of them with
+        ``force``.
+
+        Posts are read in batches by id and rendered by a process pool. Yields
+        ``(checked, rendered)`` where ``rendered`` lists the
+        ``(slug, author_id)`` of the posts rendered in the batch.
+        """
+        update = Post.__table__.update() \
+            .where(Post.id == db.bindparam('post_id')) \
+            .values(body_html=db.bindparam('html'),
+                    body_html_digest=db.bindparam('digest'))
+        last_id = 0
+        with ProcessPoolExecutor(processes) as executor:
+            while True:
+                batch = db.session.query(
+                    Post.id, Post.slug, Post.author_id, Post.body,
+                    Post.body_html_digest) \
+                    .filter(Post.id > last_id) \
+                    .order_by(Post.id).limit(batch_size).all()
+                if not batch:
+                    return
+                last_id = batch[-1].id
+                stale = []
+                for row in batch:
+                    digest = body_digest(row.body)
+                    if force or row.body_html_digest != digest:
+                        stale.append((row, digest))
+                chunksize = max(len(stale) // (4 * (processes or 4)), 1)
+                htmls = executor.map(render_markdown,
+                                     [row.body for row, _ in stale],
+                                     chunksize=chunksize)
+                params = [{'post_id': row.id, 'html': html, 'digest': digest}
+                          for (row, digest), html in zip(stale, htmls)]
+                if params:
+                    # keep updated_at: the post itself has not been edited
+                    db.session.execute(update.values(
+                        updated_at=Post.__table__.c.updated_at), params)
+                    db.session.commit()
+                yield len(batch), [(row.slug, row.author_id)
+                                   for row, _ in stale]
+
+    @staticmethod
+    def search(q, query=None):
+        """Posts matching every word of ``q``, with the expression ranking
+        them best first."""
+        terms = search_terms(q)
+        if not terms:
+            raise ValidationError('Search query has no words')
+        if query is None:
+            query = Post.query
+        return match(query, terms, Post)
+
+    def save(self, attempts=3):
+        """Add and commit the post.
+
+        When a concurrent writer takes the same slug first, the unique index
+        rejects the commit; the post then gets the next free slug and the
+        commit is retried.
+        """
+        changes = {'title': self.title, 'body': self.body}
+        for attempt in range(attempts):
+            db.session.add(self)
+            try:
+                db.session.commit()
+                return
+            except IntegrityError:
+                db.session.rollback()
+                if attempt + 1 == attempts:
+                    raise
+                # the rollback expired any edits of a persistent post
+                with db.session.no_autoflush:
+                    for key, value in changes.items():
+                        setattr(self, key, value)
+                    self.slug = Post.next_slug(Post.slugify_title(self.title))
+
+    JSON_FIELDS = ('url', 'title', 'body', 'body_html', 'created_at',
+                   'updated_at', 'author')
+
+    # built once, not for every post serialized
+    JSON_GETTERS = {
+        'url': lambda post: external_url('api.get_post', slug=post.slug),
+        'title': attrgetter('title'),
+        'body': attrgetter('body'),
+        'body_html': attrgetter('body_html'),
+        'created_at': lambda post: format_datetime(post.created_at),
+        'updated_at': lambda post: format_datetime(post.updated_at),
+        'author': lambda post: external_url('api.get_user',
+                                            username=post.author.username),
+    }
+
+    def to_json(self, fields=JSON_FIELDS):
+        """The post as JSON, limited to ``fields``; the others are not
+        loaded."""
+        getters = self.JSON_GETTERS
+        return {field: getters[field](self) for field in fields}
+
+    @staticmethod
+    def validate_json(json_post):
+        if not isinstance(json_post, dict):
+            raise ValidationError('Post is not a JSON object')
         title = json_post.get('title')
         if title is None or title == '':
             raise ValidationError('Post does not have a title')
         body = json_post.get('body')
         if body is None or body == '':
             raise ValidationError('Post does not have a body')
-        return Post(title=title, body=body)
+        return title, body
 
+    @staticmethod
+    def from_json(json_post):
+        title, body = Post.validate_json(json_post)
+        return Post(title=title, body=body)
 
+    @staticmethod
+    def import_json(json_posts, author_id, chunk_size=500, attempts=3):
+        """Validate and insert posts, one transaction per chunk.
+
+        Yields one ``(slug, error)`` pair per item, in order. Rows are
+        inserted with executemany, bypassing the ORM; a chunk whose slugs are
+        taken concurrently is re-allocated and retried.
+        """
+        json_posts = iter(json_posts)
+        numbers = {}
+        while True:
+            chunk = list(islice(json_posts, chunk_size))
+            if not chunk:
+                return
+            results = []
+            rows = []
+            for json_post in chunk:
+                try:
+                    title, body = Post.validate_json(json_post)
+                except ValidationError as e:
+                    results.append((None, e.args[0]))
+                    continue
+                results.append(len(rows))
+                rows.append({'title': title, 'body': body,
+                             'body_html': render_markdown(body),
+                             'body_html_digest': body_digest(body),
+                             'author_id': author_id})
+            for attempt in range(attempts):
+                slugs = Post.allocate_slugs([row['title'] for row in rows],
+                                            numbers)
+                now = datetime.utcnow()
+                for row, slug in zip(rows, slugs):
+                    row.update(slug=slug, created_at=now, updated_at=now)
+                try:
+                    if rows:
+                        db.session.execute(Post.__table__.insert(), rows)
+                        User.count_posts(db.session,
+                                         {author_id: (len(rows), now)})
+                    db.session.commit()
+                    break
+                except IntegrityError:
+                    db.session.rollback()
+                    numbers.clear()
+                    if attempt + 1 == attempts:
+                        raise
+            for result in results:
+                if isinstance(result, int):
+                    yield rows[result]['slug'], None
+                else:
+                    yield result
+
+
+db.event.listen(User.password_hash, 'set', User.on_changed_credentials)
+db.event.listen(User.username, 'set', User.on_changed_login)
+db.event.listen(User.email, 'set', User.on_changed_login)
+db.event.listen(User, 'after_insert', User.on_inserted)
+db.event.listen(User, 'after_update', User.on_updated)
+db.event.listen(db.session, 'after_commit', User.on_committed)
 db.event.listen(Post.title, 'set', Post.title_to_slug)
+db.event.listen(Post, 'after_insert', Post.on_inserted)
+db.event.listen(Post, 'after_delete', Post.on_deleted)
+db.event.listen(Post, 'after_update', Post.on_updated)
+db.event.listen(Post.body, 'set', Post.on_changed_body)
+db.event.listen(Post.__table__, 'after_create', create_search_index)
+db.event.listen(Post.__table__, 'before_drop', drop_search_index)
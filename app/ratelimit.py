@@ -0,0 +1,177 @@
+"""Token-bucket rate limits on API requests and failed authentications.
+
+Every request takes a token from the bucket of its client address
+(``RATELIMIT_IP``) and, when it carries credentials, from the bucket of the
+name or token it claims (``RATELIMIT_PRINCIPAL``). Failed authentications
+take a token from two stricter buckets (``RATELIMIT_AUTH_FAILURES``), and a
+client whose failure bucket is empty gets a 429 before its password is
+hashed or its user looked up. Limits are ``(tokens per second, burst)``.
+
+``RATELIMIT_BACKEND`` is ``None`` (off), ``'memory'`` (private to each
+worker), ``'sqlite'`` (a file at ``RATELIMIT_SQLITE_PATH`` shared by the
+workers of a host), or a factory (or its import path) called with the app
+and returning a :class:`RateLimitBackend`.
+"""
+import time
+import random
+import hashlib
+import threading
+from flask import request
+from flask import current_app
+from werkzeug.utils import import_string
+
+from .caches import TTLCache
+from .caches import SQLiteStore
+from .exceptions import TooManyRequestsError
+
+# a SQLite backend forgets full buckets about once every this many takes
+SQLITE_PRUNE_EVERY = 1000
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class RateLimitBackend(object):
+    """Storage of the buckets, by key.
+
+    ``take`` must be atomic across every worker sharing the backend.
+    """
+
+    def take(self, key, rate, burst, cost=1):
+        """Take ``cost`` tokens if the bucket has at least one.
+
+        Return 0 if it had, else the seconds until it will. A ``cost`` of 0
+        only checks the bucket.
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self, maxsize=65536, timer=time.monotonic):
+        self.timer = timer
+        self._buckets = TTLCache(maxsize=maxsize, timer=timer)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        with self._lock:
+            now = self.timer()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            if not cost:
+                return 0
+            tokens -= cost
+            # a bucket that would be full again is the same as no bucket
+            self._buckets.set(key, (tokens, now),
+                              ttl=(burst - tokens) / rate)
+            return 0
+
+
+class SQLiteBackend(SQLiteStore, RateLimitBackend):
+    """Buckets in a SQLite file, for the processes of one host."""
+    schema = ['CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, '
+              'tokens REAL NOT NULL, updated REAL NOT NULL, '
+              'full_at REAL NOT NULL)']
+
+    def __init__(self, path, timer=time.time):
+        super(SQLiteBackend, self).__init__(path)
+        self.timer = timer
+
+    def take(self, key, rate, burst, cost=1):
+        connection = self.connection
+        # a check does not need the write lock
+        if cost:
+            connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = self.timer()
+            row = connection.execute(
+                'SELECT tokens, updated FROM buckets WHERE key = ?',
+                (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens = refill(tokens, updated, now, rate, burst)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            if not cost:
+                return 0
+            tokens -= cost
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)',
+                (key, tokens, now, now + (burst - tokens) / rate))
+            if random.randrange(SQLITE_PRUNE_EVERY) == 0:
+                connection.execute('DELETE FROM buckets WHERE full_at < ?',
+                                   (now,))
+            return 0
+        finally:
+            if cost:
+                connection.execute('COMMIT')
+
+
+def digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:20]
+
+
+class RateLimiter(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['rate_limiter'] = self.create_backend(app)
+
+    @staticmethod
+    def create_backend(app):
+        factory = app.config['RATELIMIT_BACKEND']
+        if factory is None:
+            return None
+        if factory == 'memory':
+            return MemoryBackend()
+        if factory == 'sqlite':
+            return SQLiteBackend(app.config['RATELIMIT_SQLITE_PATH'])
+        if isinstance(factory, str):
+            factory = import_string(factory)
+        return factory(app)
+
+    @property
+    def backend(self):
+        return current_app.extensions['rate_limiter']
+
+    @staticmethod
+    def keys():
+        """The client address and, if credentials are given, a digest of
+        the name or token they claim."""
+        keys = [('ip', request.remote_addr)]
+        authorization = request.authorization
+        if authorization is not None and authorization.username:
+            keys.append(('principal', digest(authorization.username)))
+        return keys
+
+    def check_request(self):
+        """Raise :class:`TooManyRequestsError` if the client is over a
+        request limit or has failed to authenticate too often."""
+        backend = self.backend
+        if backend is None:
+            return
+        config = current_app.config
+        for kind, value in self.keys():
+            rate, burst = config['RATELIMIT_AUTH_FAILURES']
+            wait = backend.take('auth-failures:{}:{}'.format(kind, value),
+                                rate, burst, cost=0)
+            if wait:
+                raise TooManyRequestsError(
+                    'Too many failed authentications', wait)
+            rate, burst = config['RATELIMIT_' + kind.upper()]
+            wait = backend.take('requests:{}:{}'.format(kind, value),
+                                rate, burst)
+            if wait:
+                raise TooManyRequestsError('Too many requests', wait)
+
+    def auth_failed(self):
+        backend = self.backend
+        if backend is None:
+            return
+        rate, burst = current_app.config['RATELIMIT_AUTH_FAILURES']
+        for kind, value in self.keys():
+            backend.take('auth-failures:{}:{}'.format(kind, value), rate,
+                         burst)
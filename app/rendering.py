@@ -0,0 +1,48 @@
+"""Markdown rendering of post bodies.
+
+Rendered HTML is stored next to the body together with a digest of the body
+and the renderer settings, so a post only needs rendering again when either
+changes. The digest covers the allowlist and the Markdown and bleach
+versions; bump ``RENDERER_VERSION`` for any other change to the output, then
+run ``flask rerender``.
+"""
+import hashlib
+import bleach
+import markdown as markdown_module
+from markdown import markdown
+
+RENDERER_VERSION = '1'
+
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em',
+                'i', 'li', 'ol', 'pre', 'strong', 'ul', 'h1', 'h2', 'h3',
+                'h4', 'h5', 'h6', 'p', 'hr', 'br', 'img']
+
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'abbr': ['title'],
+    'acronym': ['title'],
+    'img': ['src', 'alt', 'title'],
+}
+
+RENDERER_SIGNATURE = repr((RENDERER_VERSION,
+                           markdown_module.version,
+                           bleach.__version__,
+                           sorted(ALLOWED_TAGS),
+                           sorted(ALLOWED_ATTRIBUTES.items())))
+
+
+def render_markdown(text):
+    """Sanitized HTML of the Markdown ``text``."""
+    if text is None:
+        return None
+    html = markdown(text, output_format='html')
+    return bleach.linkify(bleach.clean(html,
+                                       tags=ALLOWED_TAGS,
+                                       attributes=ALLOWED_ATTRIBUTES,
+                                       strip=True))
+
+
+def body_digest(text):
+    """A digest of ``text`` and the renderer settings."""
+    key = '{}\0{}'.format(RENDERER_SIGNATURE, text or '')
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
@@ -0,0 +1,102 @@
+"""Full-text search over posts.
+
+SQLite keeps an FTS5 table over the titles and bodies, filled by triggers on
+``posts`` so that ORM and bulk (executemany) writes alike are indexed.
+Postgres matches against a GIN expression index on the ``tsvector`` of the
+title and body, which it keeps current by itself. Other databases fall back
+to an unranked substring match.
+
+Ranks sort ascending, best match first, on every database.
+"""
+import re
+
+from . import db
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE posts_fts USING fts5("
+    "title, body, content='posts', content_rowid='id')",
+    "CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts(rowid, title, body) "
+    "VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, body ON posts "
+    "BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO posts_fts(rowid, title, body) "
+    "VALUES (new.id, new.title, new.body); END",
+    # index the posts already there
+    "INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_INDEX = [
+    "CREATE INDEX ix_posts_search ON posts USING gin "
+    "(to_tsvector('english', "
+    "coalesce(title, '') || ' ' || coalesce(body, '')))",
+]
+
+INDEXES = {
+    'sqlite': (SQLITE_INDEX, [
+        'DROP TRIGGER IF EXISTS posts_fts_insert',
+        'DROP TRIGGER IF EXISTS posts_fts_delete',
+        'DROP TRIGGER IF EXISTS posts_fts_update',
+        'DROP TABLE IF EXISTS posts_fts',
+    ]),
+    'postgresql': (POSTGRES_INDEX, ['DROP INDEX IF EXISTS ix_posts_search']),
+}
+
+# weights of title and body matches in the SQLite ranking
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+posts_fts = db.table('posts_fts', db.column('rowid'))
+
+
+def create_search_index(target, connection, **kw):
+    for statement in INDEXES.get(connection.dialect.name, ([], []))[0]:
+        connection.execute(statement)
+
+
+def drop_search_index(target, connection, **kw):
+    for statement in INDEXES.get(connection.dialect.name, ([], []))[1]:
+        connection.execute(statement)
+
+
+def search_terms(q):
+    """The words of the search string ``q``."""
+    return re.findall(r'\w+', q or '', re.UNICODE)
+
+
+def match(query, terms, model, dialect=None):
+    """Narrow a ``model`` query to the rows matching every one of ``terms``.
+
+    Returns the query and the rank expression to order it by. ``dialect``
+    defaults to the one of the database the model is bound to.
+    """
+    id, title, body = model.id, model.title, model.body
+    if dialect is None:
+        dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    if dialect == 'sqlite':
+        match = ' '.join('"{}"'.format(term) for term in terms)
+        rank = db.func.bm25(db.literal_column('posts_fts'),
+                            TITLE_WEIGHT, BODY_WEIGHT)
+        query = query.join(posts_fts, posts_fts.c.rowid == id) \
+            .filter(db.literal_column('posts_fts').op('MATCH')(match))
+        return query, rank
+    if dialect == 'postgresql':
+        english = db.literal_column("'english'")
+        vector = db.func.to_tsvector(
+            english,
+            db.func.coalesce(title, '') + ' ' + db.func.coalesce(body, ''))
+        tsquery = db.func.plainto_tsquery(english, ' '.join(terms))
+        query = query.filter(vector.op('@@')(tsquery))
+        # ts_rank_cd is a real; as a double, the rank in a cursor compares
+        # equal to the one of its post
+        return query, db.cast(-db.func.ts_rank_cd(vector, tsquery),
+                              db.Float(precision=53))
+    for term in terms:
+        pattern = '%{}%'.format(term)
+        query = query.filter(db.or_(title.ilike(pattern), body.ilike(pattern)))
+    return query, db.literal_column('0.0')
@@ -0,0 +1,100 @@
+"""JSON encoding of API responses.
+
+``to_json`` methods hand over plain dicts of strings and numbers: datetimes
+are formatted by :func:`format_datetime` and links are built by
+:func:`external_url` from a template made once per request. The encoder
+then has nothing to fall back on, so any ``dumps`` will do;
+``API_JSON_ENCODER`` is ``'auto'`` (ujson when installed), ``'json'``, or a
+``dumps`` callable or its import path.
+
+``API_DATETIME_FORMAT`` is ``'http'`` (RFC 1123, as Flask's encoder writes
+it) or ``'iso8601'``.
+"""
+import json
+from urllib.parse import quote
+from flask import g
+from flask import url_for
+from flask import current_app
+from flask import has_request_context
+from werkzeug.http import http_date
+from werkzeug.utils import import_string
+
+from .instrumentation import timer
+
+DATETIME_FORMATS = {
+    'http': lambda value: http_date(value.utctimetuple()),
+    'iso8601': lambda value: value.isoformat() + 'Z',
+}
+
+
+def json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def load_encoder(name):
+    if callable(name):
+        return name
+    if name == 'auto':
+        try:
+            import ujson
+        except ImportError:
+            return json_dumps
+        return lambda obj: ujson.dumps(obj, ensure_ascii=False,
+                                       escape_forward_slashes=False)
+    if name == 'json':
+        return json_dumps
+    return import_string(name)
+
+
+class Serializer(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['serializer'] = {
+            'dumps': load_encoder(app.config['API_JSON_ENCODER']),
+            'format_datetime':
+                DATETIME_FORMATS[app.config['API_DATETIME_FORMAT']],
+        }
+
+
+def dumps(obj):
+    return current_app.extensions['serializer']['dumps'](obj)
+
+
+def jsonify(obj):
+    with timer('serialize'):
+        data = dumps(obj) + '\n'
+    return current_app.response_class(data, mimetype='application/json')
+
+
+def format_datetime(value):
+    if value is None:
+        return None
+    return current_app.extensions['serializer']['format_datetime'](value)
+
+
+def quote_segment(value):
+    """Quote a URL rule argument like werkzeug's converters do."""
+    return quote(str(value), safe='/:+')
+
+
+def external_url(endpoint, **values):
+    """``url_for(endpoint, _external=True, **values)`` for URL rule
+    arguments, from a template built once per request and endpoint."""
+    if not has_request_context():
+        return url_for(endpoint, _external=True, **values)
+    templates = g.setdefault('url_templates', {})
+    key = (endpoint, tuple(sorted(values)))
+    template = templates.get(key)
+    if template is None:
+        markers = {name: '\x00{}\x00'.format(name) for name in values}
+        url = url_for(endpoint, _external=True, **markers)
+        template = templates[key] = (
+            url, [(quote_segment(marker), name)
+                  for name, marker in markers.items()])
+    url, slots = template
+    for marker, name in slots:
+        url = url.replace(marker, quote_segment(values[name]))
+    return url
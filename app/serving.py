@@ -0,0 +1,54 @@
+"""The uWSGI profile for serving many concurrent requests, derived from the
+app's configuration and written by ``flask uwsgi-profile``.
+
+Each worker process runs ``UWSGI_THREADS`` threads, so a request waiting on
+the database pins a thread rather than a process. Threads never outnumber
+the connections a process may open (``SQLALCHEMY_POOL_SIZE`` plus
+``SQLALCHEMY_MAX_OVERFLOW``), or they would queue on the pool instead of in
+the listen backlog. ``UWSGI_PROCESSES`` of 0 runs one process per CPU.
+"""
+import os
+
+
+def uwsgi_threads(config):
+    threads = config['UWSGI_THREADS']
+    pool_size = config.get('SQLALCHEMY_POOL_SIZE')
+    if pool_size is not None:
+        threads = min(threads,
+                      pool_size + config.get('SQLALCHEMY_MAX_OVERFLOW', 0))
+    return max(threads, 1)
+
+
+def uwsgi_options(config):
+    """The tuning options of the profile, as ``(name, value)`` pairs; a value
+    of ``True`` is a flag."""
+    processes = config['UWSGI_PROCESSES'] or os.cpu_count() or 1
+    return [
+        ('master', True),
+        ('processes', processes),
+        ('threads', uwsgi_threads(config)),
+        # one accept at a time, rather than waking every worker
+        ('thunder-lock', True),
+        ('listen', config['UWSGI_LISTEN']),
+        ('harakiri', config['UWSGI_HARAKIRI']),
+        ('max-requests', config['UWSGI_MAX_REQUESTS']),
+        ('single-interpreter', True),
+        ('need-app', True),
+        ('die-on-term', True),
+    ]
+
+
+def uwsgi_ini(config, socket, module='manage:app', chown_socket=None):
+    """The profile as the text of a uWSGI ini file."""
+    options = [('socket', socket)]
+    if chown_socket:
+        options.append(('chown-socket', chown_socket))
+    options.append(('module', module))
+    if config.get('CONFIG_NAME'):
+        # the workers load the configuration the profile was sized for
+        options.append(('env', 'FLASK_CONFIG=' + config['CONFIG_NAME']))
+    options.extend(uwsgi_options(config))
+    lines = ['[uwsgi]'] + ['{} = {}'.format(name, 'true' if value is True
+                                            else value)
+                           for name, value in options]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,194 @@
+"""Latency and throughput of the main API endpoints.
+
+Seeds a dataset of fake users and posts, then sends each scenario's
+requests one after the other through the Flask test client and, with
+--uwsgi, through the socket of a uWSGI server started on the same database.
+Reports p50/p95/p99 latency and throughput per scenario; --output also
+writes them as JSON, for ``python -m benchmarks.compare``.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+from datetime import datetime
+from contextlib import contextmanager
+
+from app import db
+from app.fake import generate
+from app.models import User
+from .common import bench_app
+from .common import TestClient
+from .common import api_headers
+from .common import summarize
+from .uwsgi_client import UwsgiClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL = 'bench@example.com'
+PASSWORD = 'bench'
+
+
+def seed_database(users, posts, seed):
+    """Fill the database of the current app with fake users and posts, and
+    the benchmark user, and return its URI."""
+    generate(users, posts, seed=seed)
+    db.session.add(User(username='bench', email=EMAIL, password=PASSWORD))
+    db.session.commit()
+    database_uri = str(db.engine.url)
+    # tear down the seeding session, the servers open their own
+    db.session.remove()
+    return database_uri
+
+
+def scenarios(client):
+    """``(name, method, url, headers, make_data, expected_status)``, writes
+    last so that reads see the seeded dataset."""
+    status, data = client.request('GET', '/api/v1.0/token',
+                                  api_headers(EMAIL, PASSWORD))
+    assert status == 200, 'cannot get a token: {}'.format(status)
+    token = json.loads(data.decode('utf-8'))['token']
+    numbers = itertools.count()
+
+    def new_post():
+        return json.dumps({
+            'title': 'Benchmark post {}'.format(next(numbers)),
+            'body': 'A *benchmark* post with [a link](http://example.com).',
+        })
+
+    return [
+        ('anonymous list', 'GET', '/api/v1.0/posts/', api_headers(), None,
+         200),
+        ('token auth list', 'GET', '/api/v1.0/posts/', api_headers(token),
+         None, 200),
+        ('basic auth list', 'GET', '/api/v1.0/posts/',
+         api_headers(EMAIL, PASSWORD), None, 200),
+        ('create post', 'POST', '/api/v1.0/posts/',
+         api_headers(EMAIL, PASSWORD), new_post, 201),
+    ]
+
+
+def run(client, requests, warmup):
+    results = {}
+    for name, method, url, headers, make_data, expected in scenarios(client):
+        def send():
+            status, _ = client.request(method, url, headers,
+                                       make_data() if make_data else b'')
+            return status == expected
+
+        for i in range(warmup):
+            send()
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        for i in range(requests):
+            request_start = time.perf_counter()
+            errors += not send()
+            latencies.append(time.perf_counter() - request_start)
+        results[name] = summarize(latencies, time.perf_counter() - start,
+                                  errors)
+    return results
+
+
+@contextmanager
+def uwsgi_server(executable, database_uri, options):
+    """Start ``manage:app`` under uWSGI with the production configuration on
+    ``database_uri`` and yield the address of its socket.
+
+    ``options`` are ``(name, value)`` pairs, as given by
+    :func:`app.serving.uwsgi_options`; a value of ``True`` is a flag.
+    """
+    directory = tempfile.mkdtemp()
+    address = os.path.join(directory, 'bench.sock')
+    # a benchmark client is one address sending as fast as it can
+    env = dict(os.environ, FLASK_CONFIG='production',
+               DATABASE_URL=database_uri, RATELIMIT_BACKEND='')
+    env.setdefault('SECRET_KEY', 'benchmark')
+    args = [executable, '--socket', address, '--chdir', ROOT,
+            '--module', 'manage:app', '--home', sys.prefix,
+            '--disable-logging', '--die-on-term']
+    for name, value in options:
+        args.append('--' + name)
+        if value is not True:
+            args.append(str(value))
+    process = subprocess.Popen(args, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(address):
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError('uWSGI did not start')
+            time.sleep(0.1)
+        yield address
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(directory)
+
+
+def print_results(driver, results):
+    print('{}:'.format(driver))
+    print('  {:<20} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'scenario', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name, result in results.items():
+        print('  {:<20} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f}{}'.format(
+            name, result['requests'], result['p50'], result['p95'],
+            result['p99'], result['throughput'],
+            '  ({} errors)'.format(result['errors'])
+            if result['errors'] else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=200,
+                        help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--uwsgi', action='store_true',
+                        help='also run against a uWSGI server')
+    parser.add_argument('--uwsgi-bin', default='uwsgi')
+    parser.add_argument('--processes', type=int, default=2,
+                        help='uWSGI worker processes')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    report = {
+        'started_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataset': {'users': args.users, 'posts': args.posts,
+                    'seed': args.seed},
+        'requests': args.requests,
+        'drivers': {},
+    }
+    # the response cache is on in production
+    with bench_app(RESPONSE_CACHE_BACKEND='lru') as app:
+        database_uri = seed_database(args.users, args.posts, args.seed)
+
+        results = run(TestClient(app), args.requests, args.warmup)
+        report['drivers']['test-client'] = results
+        print_results('test client', results)
+        if args.uwsgi:
+            options = [('master', True), ('processes', args.processes),
+                       ('enable-threads', True)]
+            with uwsgi_server(args.uwsgi_bin, database_uri,
+                              options) as address:
+                results = run(UwsgiClient(address), args.requests,
+                              args.warmup)
+            report['drivers']['uwsgi'] = results
+            report['uwsgi_processes'] = args.processes
+            print_results('uwsgi, {} processes'.format(args.processes),
+                          results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Requests per second of HTTP Basic authenticated reads, with and without
+the verified-credential cache."""
+import argparse
+
+from app import db
+from app.models import User
+from .common import bench_app
+from .common import api_headers
+from .common import timed
+from .common import report
+
+
+def run(cache_size, repeat):
+    with bench_app(CREDENTIAL_CACHE_SIZE=cache_size) as app:
+        db.session.add(User(username='john', email='john@example.com',
+                            password='cat'))
+        db.session.commit()
+        client = app.test_client()
+        headers = api_headers('john', 'cat')
+
+        def request():
+            response = client.get('/api/v1.0/posts/', headers=headers)
+            assert response.status_code == 200
+
+        request()
+        return timed(request, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=200)
+    args = parser.parse_args()
+    report('basic auth, no credential cache', args.requests,
+           run(0, args.requests))
+    report('basic auth, credential cache', args.requests,
+           run(1024, args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks are run from the repository root, e.g.::
+
+    python -m benchmarks.basic_auth
+"""
+import os
+import math
+import time
+import tempfile
+from base64 import b64encode
+from contextlib import contextmanager
+
+from config import config
+from config import TestingConfig
+from app import create_app
+from app import db
+from app.models import Role
+
+
+@contextmanager
+def bench_app(**settings):
+    """Yield an app bound to a throwaway SQLite database, with ``settings``
+    overriding the testing configuration."""
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    settings.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite:///' + path)
+    settings.setdefault('DEBUG', False)
+    config['benchmark'] = type('BenchmarkConfig', (TestingConfig,), settings)
+    app = create_app('benchmark')
+    app.config['SERVER_NAME'] = 'bench.test'
+    app_context = app.app_context()
+    app_context.push()
+    try:
+        db.create_all()
+        Role.insert_roles()
+        yield app
+    finally:
+        db.session.remove()
+        db.drop_all()
+        app_context.pop()
+        os.remove(path)
+
+
+class TestClient(object):
+    """The Flask test client with the interface of
+    :class:`~benchmarks.uwsgi_client.UwsgiClient`."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, url, headers=None, data=b''):
+        response = self.client.open(url, method=method, headers=headers,
+                                    data=data)
+        return response.status_code, response.get_data()
+
+
+def api_headers(username='', password=''):
+    return {
+        'Authorization': 'Basic ' + b64encode(
+            (username + ':' + password).encode('utf-8')).decode('utf-8'),
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+    }
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+
+def report(name, repeat, elapsed):
+    print('{:<40} {:>8} in {:>7.3f}s  {:>10.1f} /s'.format(
+        name, repeat, elapsed, repeat / elapsed))
+
+
+def percentile(samples, p):
+    """Nearest-rank ``p``-th percentile of sorted ``samples``."""
+    return samples[max(0, math.ceil(p / 100.0 * len(samples)) - 1)]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Latency percentiles in milliseconds and throughput of a run."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': latencies[-1] * 1000,
+        'mean': sum(latencies) / len(latencies) * 1000,
+        'throughput': len(latencies) / elapsed,
+    }
@@ -0,0 +1,41 @@
+"""Compare two JSON reports of ``benchmarks.api``: latency percentiles and
+throughput of each scenario, and their change from the baseline."""
+import json
+import argparse
+
+METRICS = ['p50', 'p95', 'p99', 'throughput']
+
+
+def change(old, new):
+    if not old:
+        return ''
+    return '{:+.1f}%'.format((new - old) / old * 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    for driver, results in sorted(candidate['drivers'].items()):
+        old_results = baseline['drivers'].get(driver)
+        if old_results is None:
+            continue
+        print('{}:'.format(driver))
+        for name, result in sorted(results.items()):
+            old = old_results.get(name)
+            if old is None:
+                continue
+            print('  {}'.format(name))
+            for metric in METRICS:
+                print('    {:<10} {:>10.2f} -> {:>10.2f} {:>9}'.format(
+                    metric, old[metric], result[metric],
+                    change(old[metric], result[metric])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Throughput of uWSGI serving many concurrent connections.
+
+Seeds a dataset like ``benchmarks.api``, then starts uWSGI twice on it: as
+``uwsgi.ini`` runs it (one synchronous worker) and with the profile of
+``flask uwsgi-profile`` (``app/serving.py``). At each concurrency level, that
+many connections are kept open at once from an asyncio loop, sending token
+authenticated post listings, which the response cache does not serve.
+Reports p50/p95/p99 latency, throughput and errors (refused connections,
+timeouts and non-200 responses) per server and level; --output writes them
+as JSON, for ``python -m benchmarks.compare``.
+"""
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+from datetime import datetime
+from flask import Config
+
+from config import config
+from app.serving import uwsgi_options
+from .api import EMAIL
+from .api import PASSWORD
+from .api import seed_database
+from .api import uwsgi_server
+from .api import print_results
+from .common import bench_app
+from .common import api_headers
+from .common import summarize
+from .uwsgi_client import UwsgiClient
+from .uwsgi_client import AsyncUwsgiClient
+
+URL = '/api/v1.0/posts/'
+# uwsgi.ini sets no tuning
+BASELINE_OPTIONS = [('enable-threads', True)]
+
+
+def profile_options():
+    """The options ``flask uwsgi-profile`` gives the production
+    configuration."""
+    production = Config('')
+    production.from_object(config['production'])
+    return uwsgi_options(production)
+
+
+async def load(client, headers, connections, requests, timeout):
+    """Send ``requests`` requests over ``connections`` concurrent
+    connections; return the latencies, errors and elapsed time."""
+    remaining = [requests]
+    latencies = []
+    errors = [0]
+
+    async def connection():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                status, _ = await asyncio.wait_for(
+                    client.request('GET', URL, headers), timeout)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                status = None
+            latencies.append(time.perf_counter() - start)
+            errors[0] += status != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*[connection() for i in range(connections)])
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def run(address, levels, requests, timeout):
+    status, data = UwsgiClient(address).request(
+        'GET', '/api/v1.0/token', api_headers(EMAIL, PASSWORD))
+    assert status == 200, 'cannot get a token: {}'.format(status)
+    headers = api_headers(json.loads(data.decode('utf-8'))['token'])
+    client = AsyncUwsgiClient(address)
+    loop = asyncio.get_event_loop()
+    results = {}
+    for connections in levels:
+        latencies, errors, elapsed = loop.run_until_complete(load(
+            client, headers, connections, max(requests, connections),
+            timeout))
+        results['{} connections'.format(connections)] = summarize(
+            latencies, elapsed, errors)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--connections', type=int, nargs='+',
+                        default=[10, 100, 1000],
+                        help='concurrency levels')
+    parser.add_argument('-n', '--requests', type=int, default=2000,
+                        help='requests per level')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='seconds before a request counts as an error')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--uwsgi-bin', default='uwsgi')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    # refused connections are counted as errors, not logged
+    logging.getLogger('asyncio').setLevel(logging.CRITICAL)
+    # a file descriptor per connection
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    servers = [('uwsgi.ini', BASELINE_OPTIONS),
+               ('profile', profile_options())]
+    report = {
+        'started_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataset': {'users': args.users, 'posts': args.posts,
+                    'seed': args.seed},
+        'requests': args.requests,
+        'servers': {name: [[option, value] for option, value in options]
+                    for name, options in servers},
+        'drivers': {},
+    }
+    with bench_app():
+        database_uri = seed_database(args.users, args.posts, args.seed)
+        for name, options in servers:
+            with uwsgi_server(args.uwsgi_bin, database_uri,
+                              options) as address:
+                results = run(address, args.connections, args.requests,
+                              args.timeout)
+            report['drivers'][name] = results
+            print_results('{} ({})'.format(name, ', '.join(
+                option if value is True else '{}={}'.format(option, value)
+                for option, value in options)), results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Serialization of a listing of posts: Post.to_json with the API serializer
+against url_for per link and Flask's jsonify."""
+import argparse
+from flask import g
+from flask import url_for
+from flask import jsonify
+
+from app import db
+from app.models import Post
+from app.models import User
+from app.serialization import jsonify as api_jsonify
+from .common import bench_app
+from .common import timed
+from .common import report
+
+
+def flask_to_json(post):
+    """The previous Post.to_json: url_for per link, datetimes left to the
+    encoder."""
+    return {
+        'url': url_for('api.get_post', slug=post.slug, _external=True),
+        'title': post.title,
+        'body': post.body,
+        'body_html': post.body_html,
+        'created_at': post.created_at,
+        'updated_at': post.updated_at,
+        'author': url_for('api.get_user', username=post.author.username,
+                          _external=True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--posts', type=int, default=1000)
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    args = parser.parse_args()
+    with bench_app() as app:
+        User.generate_fake(10)
+        Post.generate_fake(args.posts)
+        posts = Post.query.options(db.joinedload(Post.author)).all()
+        with app.test_request_context():
+            def serialize():
+                g.pop('url_templates', None)
+                return api_jsonify(
+                    {'posts': [post.to_json() for post in posts]})
+
+            def flask_serialize():
+                return jsonify(
+                    {'posts': [flask_to_json(post) for post in posts]})
+
+            report('to_json + url_for + jsonify, {} posts'.format(
+                args.posts), args.repeat,
+                timed(flask_serialize, args.repeat))
+            report('to_json + serializer, {} posts'.format(args.posts),
+                   args.repeat, timed(serialize, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Replay of the API traffic captured in ``CAPTURE_FILE`` (see
+``app/api_1_0/capture.py``), run by ``flask replay``.
+
+Records are sent in their captured order by a pool of threads, spaced as
+they were captured divided by ``speed`` (0 sends them as fast as the pool
+allows). Credentials are not captured: Basic and token authenticated
+records are sent as one replay user. Writes are only replayed when their
+body was captured.
+"""
+import json
+import time
+import threading
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import api_headers
+from .common import summarize
+
+
+def load_capture(path):
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+class Replayer(object):
+    def __init__(self, make_client, email=None, password=None):
+        self.make_client = make_client
+        self.local = threading.local()
+        self.headers = {
+            'none': api_headers(),
+            'anonymous': api_headers(),
+        }
+        if email is not None:
+            self.headers['basic'] = api_headers(email, password)
+            status, data = self.client.request('GET', '/api/v1.0/token',
+                                               self.headers['basic'])
+            if status != 200:
+                raise ValueError('Cannot get a token for {}: {}'.format(
+                    email, status))
+            token = json.loads(data.decode('utf-8'))['token']
+            self.headers['token'] = api_headers(token)
+
+    @property
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.make_client()
+        return self.local.client
+
+    def prepare(self, record):
+        """``(method, url, headers, data)`` of a record, or ``None`` if it
+        cannot be replayed."""
+        data = b''
+        if record['method'] not in ('GET', 'HEAD'):
+            if record.get('body') is None:
+                return None
+            data = json.dumps(record['body'])
+        url = record['path']
+        if record['args']:
+            url += '?' + urlencode(record['args'], doseq=True)
+        return record['method'], url, self.headers[record['auth']], data
+
+    def send(self, record, request):
+        start = time.perf_counter()
+        try:
+            status, _ = self.client.request(*request)
+        except Exception:
+            status = None
+        return record, status, time.perf_counter() - start
+
+    def run(self, records, concurrency=4, speed=1.0):
+        needed = set(record['auth'] for record in records)
+        missing = needed - set(self.headers)
+        if missing:
+            raise ValueError('Records authenticated by {} need replay '
+                             'credentials'.format(', '.join(sorted(missing))))
+        results = []
+        skipped = 0
+        start = time.monotonic()
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = []
+            for record in records:
+                request = self.prepare(record)
+                if request is None:
+                    skipped += 1
+                    continue
+                if speed:
+                    delay = (record['time'] - records[0]['time']) / speed - \
+                        (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(executor.submit(self.send, record, request))
+            for future in futures:
+                results.append(future.result())
+        return report(results, skipped, time.monotonic() - start)
+
+
+def summarize_results(results, elapsed):
+    summary = summarize([latency for _, _, latency in results], elapsed)
+    errors = sum(1 for _, status, _ in results
+                 if status is None or status >= 500)
+    summary.update(
+        errors=errors,
+        error_rate=errors / len(results),
+        status_mismatches=sum(1 for record, status, _ in results
+                              if status != record['status']))
+    return summary
+
+
+def report(results, skipped, elapsed):
+    by_endpoint = {}
+    for result in results:
+        by_endpoint.setdefault(result[0]['endpoint'] or '<unmatched>',
+                               []).append(result)
+    return {
+        'elapsed': elapsed,
+        'skipped': skipped,
+        'overall': summarize_results(results, elapsed) if results else None,
+        'endpoints': {endpoint: summarize_results(endpoint_results, elapsed)
+                      for endpoint, endpoint_results in by_endpoint.items()},
+    }
+
+
+def format_report(replay_report):
+    lines = ['{:<28} {:>8} {:>9} {:>9} {:>9} {:>9} {:>7} {:>9}'.format(
+        'endpoint', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s',
+        'errors', 'mismatch')]
+    rows = sorted(replay_report['endpoints'].items())
+    if replay_report['overall'] is not None:
+        rows.append(('all', replay_report['overall']))
+    for endpoint, summary in rows:
+        lines.append(
+            '{:<28} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>6.1%} '
+            '{:>9}'.format(endpoint, summary['requests'], summary['p50'],
+                           summary['p95'], summary['p99'],
+                           summary['throughput'], summary['error_rate'],
+                           summary['status_mismatches']))
+    lines.append('{} records replayed in {:.1f}s, {} skipped'.format(
+        sum(summary['requests'] for _, summary in
+            replay_report['endpoints'].items()),
+        replay_report['elapsed'], replay_report['skipped']))
+    return '\n'.join(lines)
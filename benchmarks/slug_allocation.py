@@ -0,0 +1,51 @@
+"""Slug allocation for posts sharing one title: the single-query allocator
+against the previous probe-per-candidate loop."""
+import argparse
+import time
+from flask_sqlalchemy import get_debug_queries
+
+from app import db
+from app.models import Post
+from .common import bench_app
+from .common import timed
+from .common import report
+
+
+def probe_slug(base, separator='-'):
+    """The previous allocator: one EXISTS query per candidate."""
+    counter = 2
+    slug = base
+    while db.session.query(Post.query.filter_by(slug=slug).exists()).scalar():
+        slug = '{}{}{}'.format(base, separator, counter)
+        counter += 1
+    return slug
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--posts', type=int, default=1000)
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    args = parser.parse_args()
+    with bench_app():
+        n_queries = len(get_debug_queries())
+        start = time.perf_counter()
+        for i in range(args.posts):
+            db.session.add(Post(title='Same Title', body='body'))
+            if i % 100 == 99:
+                db.session.commit()
+        db.session.commit()
+        report('create posts with the same title', args.posts,
+               time.perf_counter() - start)
+        print('{:.1f} queries per post'.format(
+            (len(get_debug_queries()) - n_queries) / args.posts))
+
+        base = Post.slugify_title('Same Title')
+        assert Post.next_slug(base) == probe_slug(base)
+        report('next_slug, {} taken'.format(args.posts), args.repeat,
+               timed(lambda: Post.next_slug(base), args.repeat))
+        report('probe loop, {} taken'.format(args.posts), args.repeat,
+               timed(lambda: probe_slug(base), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
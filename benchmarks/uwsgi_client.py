@@ -0,0 +1,101 @@
+"""A minimal client for the uwsgi protocol, to send requests straight to the
+``socket`` of a uWSGI server (see ``uwsgi.ini``) with no web server in
+front."""
+import socket
+import asyncio
+import struct
+from urllib.parse import urlsplit
+
+
+def encode_vars(variables):
+    data = b''.join(
+        struct.pack('<H', len(key)) + key + struct.pack('<H', len(value)) +
+        value for key, value in (
+            (key.encode('latin-1'), value.encode('latin-1'))
+            for key, value in variables.items()))
+    # modifier1 0 is a WSGI request
+    return struct.pack('<BHB', 0, len(data), 0) + data
+
+
+def encode_request(method, url, headers, data, host):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    parts = urlsplit(url)
+    variables = {
+        'REQUEST_METHOD': method,
+        'REQUEST_URI': url,
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': host,
+        'CONTENT_LENGTH': str(len(data)),
+    }
+    for name, value in (headers or {}).items():
+        if name.lower() == 'content-type':
+            variables['CONTENT_TYPE'] = value
+        else:
+            variables['HTTP_' + name.upper().replace('-', '_')] = value
+    return encode_vars(variables) + data
+
+
+def decode_response(response):
+    """The status code and body of a raw response."""
+    head, _, body = response.partition(b'\r\n\r\n')
+    status_line = head.split(b'\r\n', 1)[0]
+    return int(status_line.split()[1]), body
+
+
+class UwsgiClient(object):
+    """Sends one request per connection to ``address``, a unix socket path
+    or ``host:port``."""
+
+    def __init__(self, address, host='localhost'):
+        self.address = address
+        self.host = host
+
+    def connect(self):
+        if '/' in self.address:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.address)
+        else:
+            host, port = self.address.rsplit(':', 1)
+            connection = socket.create_connection((host, int(port)))
+        return connection
+
+    def request(self, method, url, headers=None, data=b''):
+        """Return the status code and body of the response."""
+        connection = self.connect()
+        try:
+            connection.sendall(encode_request(method, url, headers, data,
+                                              self.host))
+            chunks = []
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            connection.close()
+        return decode_response(b''.join(chunks))
+
+
+class AsyncUwsgiClient(UwsgiClient):
+    """:class:`UwsgiClient` for asyncio, to hold many connections open from
+    one thread."""
+
+    async def request(self, method, url, headers=None, data=b''):
+        if '/' in self.address:
+            reader, writer = await asyncio.open_unix_connection(self.address)
+        else:
+            host, port = self.address.rsplit(':', 1)
+            reader, writer = await asyncio.open_connection(host, int(port))
+        try:
+            writer.write(encode_request(method, url, headers, data,
+                                        self.host))
+            response = await reader.read()
+        finally:
+            writer.close()
+        return decode_response(response)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -13,7 +14,53 @@ class Config:
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
+    SQLALCHEMY_POOL_PRE_PING = False
+    SQLALCHEMY_STATEMENT_TIMEOUT = None
+    SQLALCHEMY_REPLICA_URIS = []
+    SQLALCHEMY_REPLICA_STICKINESS = 5
+    SERVER_TIMING = True
+    SLOW_REQUEST_MS = 500
+    SLOW_QUERY_MS = 100
+    CAPTURE_FILE = os.environ.get('CAPTURE_FILE')
+    CAPTURE_SAMPLE_RATE = 1.0
+    CAPTURE_BODIES = False
     POSTS_PER_PAGE = 10
+    POSTS_BATCH_SIZE = 1000
+    POSTS_IMPORT_CHUNK_SIZE = 500
+    POSTS_LOOKUP_SIZE = 50
+    CREDENTIAL_CACHE_SIZE = 1024
+    CREDENTIAL_CACHE_TTL = 300
+    SHARED_CACHE_BACKEND = 'lru'
+    SHARED_CACHE_SIZE = 4096
+    SHARED_CACHE_SQLITE_PATH = os.environ.get('SHARED_CACHE_SQLITE_PATH') or \
+        os.path.join(tempfile.gettempdir(), 'blogapi-shared.sqlite')
+    PRINCIPAL_CACHE_SIZE = 1024
+    PRINCIPAL_CACHE_TTL = 60
+    UNKNOWN_USER_CACHE_SIZE = 4096
+    UNKNOWN_USER_CACHE_TTL = 10
+    RESPONSE_CACHE_BACKEND = 'lru'
+    RESPONSE_CACHE_SQLITE_PATH = \
+        os.environ.get('RESPONSE_CACHE_SQLITE_PATH') or \
+        os.path.join(tempfile.gettempdir(), 'blogapi-response.sqlite')
+    RATELIMIT_BACKEND = 'memory'
+    RATELIMIT_SQLITE_PATH = os.environ.get('RATELIMIT_SQLITE_PATH') or \
+        os.path.join(tempfile.gettempdir(), 'blogapi-ratelimit.sqlite')
+    RATELIMIT_IP = (20, 100)
+    RATELIMIT_PRINCIPAL = (10, 50)
+    RATELIMIT_AUTH_FAILURES = (0.1, 10)
+    RESPONSE_CACHE_SIZE = 1024
+    RESPONSE_CACHE_TIMEOUT = 60
+    COMPRESS_MIMETYPES = ['application/json']
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_LEVEL = 6
+    POSTS_STREAM_BATCH_SIZE = 100
+    API_JSON_ENCODER = 'auto'
+    API_DATETIME_FORMAT = 'http'
+    UWSGI_PROCESSES = int(os.environ.get('UWSGI_PROCESSES') or 0)
+    UWSGI_THREADS = int(os.environ.get('UWSGI_THREADS') or 8)
+    UWSGI_LISTEN = int(os.environ.get('UWSGI_LISTEN') or 1024)
+    UWSGI_HARAKIRI = 60
+    UWSGI_MAX_REQUESTS = 10000
 
     @classmethod
     def init_app(cls, app):
@@ -32,6 +79,8 @@ class TestingConfig(Config):
     TESTING = True
     DEBUG = True
     ADMIN_EMAIL = ''
+    RESPONSE_CACHE_BACKEND = None
+    RATELIMIT_BACKEND = None
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
 
@@ -41,6 +90,22 @@ class ProductionConfig(Config):
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    SQLALCHEMY_MAX_OVERFLOW = \
+        int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10)
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'sqlite') or None
+    # the workers of a host see each other's token invalidations
+    SHARED_CACHE_BACKEND = os.environ.get('SHARED_CACHE_BACKEND') or 'sqlite'
+    # a write invalidates the responses cached by every worker
+    RESPONSE_CACHE_BACKEND = \
+        os.environ.get('RESPONSE_CACHE_BACKEND', 'sqlite') or None
+    SQLALCHEMY_REPLICA_URIS = \
+        os.environ.get('DATABASE_REPLICA_URLS', '').split()
+    SQLALCHEMY_STATEMENT_TIMEOUT = \
+        int(os.environ.get('DATABASE_STATEMENT_TIMEOUT') or 30000)
 
     @classmethod
     def init_app(cls, app):
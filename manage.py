@@ -1,10 +1,15 @@
 import os
+import json
+import time
+
+import click
 
 from flask_migrate import Migrate
 from flask_migrate import MigrateCommand
 from flask_migrate import upgrade
 
 from app import db
+from app import response_cache
 from app import create_app
 from app.models import Role
 from app.models import User
@@ -69,10 +74,179 @@ def deploy():
 
 
 @app.cli.command()
-def fake():
-    """Generate some fake data for dev and test."""
-    if app.config['CONFIG_NAME'] not in ['development', 'testing']:
+@click.option('--users', default=1, help='Number of users to generate.')
+@click.option('--posts', default=25, help='Number of posts to generate.')
+@click.option('--seed', type=int, default=None,
+              help='Seed for a reproducible dataset.')
+@click.option('--password', default='password',
+              help='Password of every generated user.')
+@click.option('--batch-size', default=1000,
+              help='Number of rows inserted per transaction.')
+@click.option('--database', default=None,
+              help='Database URI to write to instead of the configured one.')
+def fake(users, posts, seed, password, batch_size, database):
+    """Generate fake data for dev, test and load testing."""
+    from app.fake import generate
+
+    if database is None and \
+            app.config['CONFIG_NAME'] not in ['development', 'testing']:
         raise ValueError('Cannot generate fake data in "{}" environment'
                          .format(app.config['CONFIG_NAME']))
-    User.generate_fake(1)
-    Post.generate_fake(25)
+    if database is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = database
+    db.create_all()
+    state = {'kind': None, 'last': time.time()}
+
+    def progress(kind, done, total):
+        now = time.time()
+        if kind != state['kind']:
+            state.update(kind=kind, start=state['last'])
+        state['last'] = now
+        click.echo('{}: {}/{} ({:.0f} rows/s)'.format(
+            kind, done, total, done / max(now - state['start'], 1e-6)))
+
+    generate(users, posts, seed=seed, password=password,
+             batch_size=batch_size, progress=progress)
+
+
+@app.cli.command('import-posts')
+@click.argument('path', type=click.File('r'))
+@click.option('--author', required=True,
+              help='Username of the author of the imported posts.')
+@click.option('--chunk-size', default=app.config['POSTS_IMPORT_CHUNK_SIZE'],
+              help='Number of posts inserted per transaction.')
+def import_posts(path, author, chunk_size):
+    """Import posts from a JSON Lines file of {"title", "body"} objects."""
+    user = User.query.filter_by(username=author).first()
+    if user is None:
+        raise click.BadParameter('no such user', param_hint='--author')
+    line_numbers = []
+
+    def json_posts():
+        for line_number, line in enumerate(path, 1):
+            if not line.strip():
+                continue
+            line_numbers.append(line_number)
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+    start = time.time()
+    created = errors = 0
+    results = Post.import_json(json_posts(), user.id, chunk_size=chunk_size)
+    for i, (slug, error) in enumerate(results):
+        if error is None:
+            created += 1
+        else:
+            errors += 1
+            click.echo('line {}: {}'.format(line_numbers[i], error), err=True)
+        if (i + 1) % chunk_size == 0:
+            click.echo('{} posts processed'.format(i + 1))
+    if created:
+        response_cache.invalidate('posts', 'user-posts:' + user.username)
+    click.echo('Imported {} posts ({} errors) in {:.1f}s'.format(
+        created, errors, time.time() - start))
+
+
+@app.cli.command()
+@click.option('--batch-size', default=500,
+              help='Number of posts read and updated at a time.')
+@click.option('--processes', type=int, default=None,
+              help='Number of rendering processes; one per CPU by default.')
+@click.option('--all', 'force', is_flag=True,
+              help='Render every post, not only the stale ones.')
+def rerender(batch_size, processes, force):
+    """Render the HTML of the posts again after the renderer changed."""
+    start = time.time()
+    checked = 0
+    slugs = []
+    author_ids = set()
+    for count, rendered in Post.rerender(batch_size, processes, force):
+        checked += count
+        slugs.extend(slug for slug, _ in rendered)
+        author_ids.update(author_id for _, author_id in rendered)
+        click.echo('{} posts checked, {} rendered'.format(
+            checked, len(slugs)))
+    if slugs:
+        usernames = [username for username, in db.session.query(
+            User.username).filter(User.id.in_(author_ids))]
+        response_cache.invalidate(
+            'posts', *(['post:' + slug for slug in slugs] +
+                       ['user-posts:' + username for username in usernames]))
+    click.echo('Rendered {} of {} posts in {:.1f}s'.format(
+        len(slugs), checked, time.time() - start))
+
+
+@app.cli.command()
+@click.option('--batch-size', default=1000,
+              help='Number of users checked and updated at a time.')
+def recount(batch_size):
+    """Rebuild the post counters of the users from their posts."""
+    start = time.time()
+    checked = 0
+    usernames = []
+    for count, corrected in User.recount(batch_size):
+        checked += count
+        usernames.extend(corrected)
+        click.echo('{} users checked, {} corrected'.format(
+            checked, len(usernames)))
+    if usernames:
+        response_cache.invalidate(
+            *['user-posts:' + username for username in usernames])
+    click.echo('Corrected {} of {} users in {:.1f}s'.format(
+        len(usernames), checked, time.time() - start))
+
+
+@app.cli.command()
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--concurrency', default=4,
+              help='Number of requests in flight at a time.')
+@click.option('--speed', default=1.0,
+              help='Time scale: 2 replays twice as fast as captured, '
+                   '0 as fast as possible.')
+@click.option('--socket', 'address', default=None,
+              help='uWSGI socket (path or host:port) to replay against '
+                   'instead of this app.')
+@click.option('--email', default=None,
+              help='User replaying Basic and token authenticated requests.')
+@click.option('--password', default=None)
+@click.option('--output', type=click.File('w'), default=None,
+              help='Write the report as JSON.')
+def replay(path, concurrency, speed, address, email, password, output):
+    """Replay API traffic captured in CAPTURE_FILE and report latencies."""
+    from benchmarks.common import TestClient
+    from benchmarks.uwsgi_client import UwsgiClient
+    from benchmarks.replay import Replayer
+    from benchmarks.replay import load_capture
+    from benchmarks.replay import format_report
+
+    if address is not None:
+        def make_client():
+            return UwsgiClient(address)
+    else:
+        def make_client():
+            return TestClient(app)
+    records = load_capture(path)
+    try:
+        replayer = Replayer(make_client, email, password)
+        replay_report = replayer.run(records, concurrency, speed)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo(format_report(replay_report))
+    if output is not None:
+        json.dump(replay_report, output, indent=2, sort_keys=True)
+
+
+@app.cli.command('uwsgi-profile')
+@click.option('--socket', 'address', default='/BlogAPISock/app.sock',
+              help='Socket (path or host:port) uWSGI listens on.')
+@click.option('--chown-socket', default='www-data:www-data',
+              help='Owner of a unix socket; empty to leave it.')
+@click.option('--output', type=click.File('w'), default='-',
+              help='File to write the ini to; stdout by default.')
+def uwsgi_profile(address, chown_socket, output):
+    """Write a uWSGI ini of processes and threads sized from the config."""
+    from app.serving import uwsgi_ini
+
+    output.write(uwsgi_ini(app.config, address, chown_socket=chown_socket))
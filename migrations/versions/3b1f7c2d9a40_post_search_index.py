@@ -0,0 +1,30 @@
+"""post search index
+
+Revision ID: 3b1f7c2d9a40
+Revises: a5d2e9c4b7f1
+Create Date: 2026-10-18 04:40:11.204519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.search import INDEXES
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f7c2d9a40'
+down_revision = 'a5d2e9c4b7f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create, drop = INDEXES.get(op.get_bind().dialect.name, ([], []))
+    for statement in create:
+        op.execute(statement)
+
+
+def downgrade():
+    create, drop = INDEXES.get(op.get_bind().dialect.name, ([], []))
+    for statement in drop:
+        op.execute(statement)
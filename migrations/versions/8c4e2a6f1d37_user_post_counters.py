@@ -0,0 +1,38 @@
+"""user post counters
+
+Revision ID: 8c4e2a6f1d37
+Revises: 3b1f7c2d9a40
+Create Date: 2026-10-18 09:12:47.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2a6f1d37'
+down_revision = '3b1f7c2d9a40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('post_count', sa.Integer(),
+                                     nullable=False, server_default='0'))
+    op.add_column('users', sa.Column('last_post_at', sa.DateTime(),
+                                     nullable=True))
+    op.create_index('ix_posts_author_id_created_at', 'posts',
+                    ['author_id', 'created_at'], unique=False)
+    op.execute(
+        'UPDATE users SET '
+        'post_count = (SELECT count(*) FROM posts '
+        'WHERE posts.author_id = users.id), '
+        'last_post_at = (SELECT max(posts.created_at) FROM posts '
+        'WHERE posts.author_id = users.id)')
+
+
+def downgrade():
+    op.drop_index('ix_posts_author_id_created_at', table_name='posts')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('last_post_at')
+        batch_op.drop_column('post_count')
@@ -0,0 +1,31 @@
+"""post body html
+
+Revision ID: a5d2e9c4b7f1
+Revises: e78075a08ef3
+Create Date: 2026-10-18 04:33:05.917342
+
+Existing posts get no HTML here: run ``flask rerender`` after upgrading,
+which renders every post whose ``body_html_digest`` does not match its body.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d2e9c4b7f1'
+down_revision = 'e78075a08ef3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('body_html', sa.Text(), nullable=True))
+    op.add_column('posts', sa.Column('body_html_digest', sa.String(length=40),
+                                     nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('body_html_digest')
+        batch_op.drop_column('body_html')
@@ -1,15 +1,57 @@
+import os
+import re
 import unittest
+import tempfile
 import json
+import zlib
+import gzip
 import time
+import pickle
 from datetime import datetime
 from base64 import b64encode
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
 from flask import url_for
+from flask_sqlalchemy import get_debug_queries
+from sqlalchemy.dialects import postgresql
 
 from app import create_app
 from app import db
+from app import serializer
 from app.models import User
 from app.models import Post
 from app.models import Role
+from app.caches import CacheBackend
+from app.caches import LRUBackend
+from app.caches import SQLiteBackend as SQLiteCacheBackend
+from app.ratelimit import MemoryBackend
+from app.ratelimit import SQLiteBackend
+from app.search import match
+from app.api_1_0.pagination import paginate_ranked
+from app.api_1_0.pagination import seek_posts
+
+
+class PickleBackend(CacheBackend):
+    """Stands in for a shared backend: values only survive pickling."""
+    store = {}
+
+    def __init__(self, app):
+        PickleBackend.store = {}
+
+    def get(self, key):
+        value = self.store.get(key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        self.store[key] = pickle.dumps(value)
+
+    def incr(self, key):
+        value = (self.get(key) or 0) + 1
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        self.store.clear()
 
 
 class APITestCase(unittest.TestCase):
@@ -98,6 +140,40 @@ class APITestCase(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 403)
 
+    def test_password_auth_queries(self):
+        self.create_john_cat()
+
+        # username and email logins look the user up in one query
+        for name in ['john', 'john@example.com']:
+            db.session.remove()
+            n_queries = len(get_debug_queries())
+            response = self.client.get(
+                url_for('api.get_token'),
+                headers=self.get_api_headers(name, 'cat'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(get_debug_queries()), n_queries + 1)
+
+        # unknown names are remembered
+        for expected_queries in [1, 0]:
+            db.session.remove()
+            n_queries = len(get_debug_queries())
+            response = self.client.get(
+                url_for('api.get_token'),
+                headers=self.get_api_headers('susan@example.com', 'dog'))
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(len(get_debug_queries()),
+                             n_queries + expected_queries)
+
+        # until a user takes them
+        r = Role.query.filter_by(name='User').first()
+        db.session.add(User(email='susan@example.com', username='susan',
+                            password='dog', role=r))
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.get_token'),
+            headers=self.get_api_headers('susan@example.com', 'dog'))
+        self.assertEqual(response.status_code, 200)
+
     def test_token_auth(self):
         self.create_john_cat()
 
@@ -139,6 +215,38 @@ class APITestCase(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 200)
 
+    def test_token_auth_without_queries(self):
+        self.create_john_cat()
+        response = self.client.get(
+            url_for('api.get_token'),
+            headers=self.get_api_headers('john@example.com', 'cat')
+        )
+        token = json.loads(response.data.decode('utf-8'))['token']
+
+        # once the principal is cached, verifying a token needs no SQL
+        response = self.client.get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 200)
+        db.session.remove()
+        n_queries = len(get_debug_queries())
+        response = self.client.get(
+            url_for('api.get_token'),
+            headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(get_debug_queries()), n_queries)
+
+        # tokens issued before a password change are rejected
+        response = self.client.put(
+            url_for('api.change_password', username='john'),
+            headers=self.get_api_headers(token, ''),
+            data=json.dumps({'password': 'dog'}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 403)
+
     def test_anonymous(self):
         response = self.client.get(
             url_for('api.get_posts'),
@@ -187,6 +295,8 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.data.decode('utf-8'))
         self.assertEqual(json_response['url'], url)
         self.assertEqual(json_response['body'], 'body of the *blog* post')
+        self.assertEqual(json_response['body_html'],
+                         '<p>body of the <em>blog</em> post</p>')
         self.assertIsNotNone(json_response['created_at'])
         self.assertIsNotNone(json_response['updated_at'])
         created_at = json_response['created_at']
@@ -611,3 +721,1009 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(len(json_response['posts']), 1)
         self.assertIsNotNone(json_response['prev'])
         self.assertIsNone(json_response['next'])
+
+        # posts created together are paged newest id first
+        db.session.execute(Post.__table__.update().values(
+            created_at=datetime(2017, 1, 1)))
+        db.session.commit()
+        expected = [url_for('api.get_post', slug=post.slug, _external=True)
+                    for post in Post.query.order_by(Post.id.desc())]
+        urls = []
+        url = url_for('api.get_posts')
+        while url:
+            response = self.client.get(
+                url, headers=self.get_api_headers('', ''))
+            json_response = json.loads(response.data.decode('utf-8'))
+            urls.extend(post['url'] for post in json_response['posts'])
+            url = json_response['next']
+        self.assertEqual(urls, expected)
+
+    def test_post_cursor_pagination(self):
+        n_per_page = self.app.config['POSTS_PER_PAGE']
+        n = 2 * n_per_page + 1
+        User.generate_fake(20)
+        Post.generate_fake(n)
+
+        # first page in cursor mode does not count
+        response = self.client.get(
+            url_for('api.get_posts', cursor=''),
+            headers=self.get_api_headers('', ''),
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertIsNone(json_response['count'])
+        self.assertEqual(len(json_response['posts']), n_per_page)
+        self.assertIsNone(json_response['prev'])
+        self.assertIsNotNone(json_response['next'])
+        first_page = json_response['posts']
+        urls = [post['url'] for post in json_response['posts']]
+
+        # follow next links to the end
+        response = self.client.get(
+            json_response['next'],
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['posts']), n_per_page)
+        self.assertIsNotNone(json_response['prev'])
+        urls += [post['url'] for post in json_response['posts']]
+        response = self.client.get(
+            json_response['next'],
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['posts']), 1)
+        self.assertIsNone(json_response['next'])
+        urls += [post['url'] for post in json_response['posts']]
+
+        # every post is seen exactly once, in the same order as page mode
+        self.assertEqual(len(set(urls)), n)
+        expected = [url_for('api.get_post', slug=p.slug, _external=True)
+                    for p in Post.query.order_by(Post.created_at.desc(),
+                                                 Post.id.desc())]
+        self.assertEqual(urls, expected)
+
+        # walk back with prev links
+        response = self.client.get(
+            json_response['prev'],
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([post['url'] for post in json_response['posts']],
+                         urls[n_per_page:2 * n_per_page])
+        response = self.client.get(
+            json_response['prev'],
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['posts'], first_page)
+        self.assertIsNone(json_response['prev'])
+
+        # count on request, carried along the links
+        response = self.client.get(
+            url_for('api.get_posts', cursor='', count=1),
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['count'], n)
+        response = self.client.get(
+            json_response['next'],
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['count'], n)
+
+        # bad cursor
+        response = self.client.get(
+            url_for('api.get_posts', cursor='not-a-cursor'),
+            headers=self.get_api_headers('', ''),
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_cursor_seek_plan(self):
+        for direction, query in [('n', Post.query),
+                                 ('p', Post.query.filter_by(author_id=1))]:
+            seek = seek_posts(query, direction, datetime.utcnow(), 1)
+            statement = seek.order_by(Post.created_at.desc()).statement \
+                .compile(dialect=db.engine.dialect)
+            plan = db.session.connection().execute(
+                'EXPLAIN QUERY PLAN ' + str(statement),
+                *[statement.params[name] for name in statement.positiontup]
+            ).fetchall()
+            detail = ' '.join(row[-1] for row in plan)
+            self.assertIn('SEARCH', detail)
+            self.assertNotIn('SCAN', detail)
+
+    def test_user_posts_pagination(self):
+        n_per_page = self.app.config['POSTS_PER_PAGE']
+        n = n_per_page + 1
+        User.generate_fake(1)
+        Post.generate_fake(n)
+        u = User.query.first()
+
+        # page links keep the username
+        response = self.client.get(
+            url_for('api.get_user_posts', username=u.username),
+            headers=self.get_api_headers('', ''),
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['count'], n)
+        response = self.client.get(
+            json_response['next'],
+            headers=self.get_api_headers('', ''),
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['posts']), 1)
+
+        # cursor mode
+        response = self.client.get(
+            url_for('api.get_user_posts', username=u.username, cursor=''),
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['posts']), n_per_page)
+        self.assertIn(u.username, json_response['next'])
+        response = self.client.get(
+            json_response['next'],
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['posts']), 1)
+        self.assertIsNone(json_response['next'])
+
+        # the author's post counter stands in for counting the posts
+        db.session.remove()
+        n_queries = len(get_debug_queries())
+        response = self.client.get(
+            url_for('api.get_user_posts', username=u.username, page=2),
+            headers=self.get_api_headers('', ''),
+        )
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['count'], n)
+        self.assertIsNotNone(json_response['prev'])
+        self.assertIsNone(json_response['next'])
+        statements = [query.statement.lower()
+                      for query in get_debug_queries()[n_queries:]]
+        self.assertFalse([s for s in statements if 'count(' in s
+                          or 'max(' in s])
+
+    def count_queries(self, url):
+        db.session.remove()
+        n_queries = len(get_debug_queries())
+        response = self.client.get(url, headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+        return len(get_debug_queries()) - n_queries
+
+    def test_post_list_query_count(self):
+        n_per_page = self.app.config['POSTS_PER_PAGE']
+        User.generate_fake(n_per_page)
+        Post.generate_fake(3 * n_per_page)
+        users = User.query.all()
+        u = users[0]
+        posts = Post.query.order_by(Post.created_at.desc()).all()
+        for post in posts:
+            post.author = u
+        db.session.commit()
+        urls = [
+            url_for('api.get_posts'),
+            url_for('api.get_posts', cursor=''),
+            url_for('api.get_user_posts', username=u.username),
+        ]
+        one_author = [self.count_queries(url) for url in urls]
+
+        # a full page by many authors costs the same number of queries
+        posts = Post.query.order_by(Post.created_at.desc()).all()
+        for post, author in zip(posts, users):
+            post.author = author
+        db.session.commit()
+        many_authors = [self.count_queries(url) for url in urls]
+        self.assertEqual(one_author, many_authors)
+
+    def test_post_fieldsets(self):
+        n_per_page = self.app.config['POSTS_PER_PAGE']
+        User.generate_fake(3)
+        Post.generate_fake(2 * n_per_page)
+        u = User.query.first()
+        for url in [url_for('api.get_posts'),
+                    url_for('api.get_user_posts', username=u.username)]:
+            db.session.remove()
+            n_queries = len(get_debug_queries())
+            response = self.client.get(
+                url + '?fields=url,title,created_at',
+                headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 200)
+            statements = [query.statement
+                          for query in get_debug_queries()[n_queries:]]
+            self.assertFalse(any(re.search(r'posts\.body\b', statement)
+                                 for statement in statements))
+            json_response = json.loads(response.data.decode('utf-8'))
+            for post in json_response['posts']:
+                self.assertEqual(sorted(post.keys()),
+                                 ['created_at', 'title', 'url'])
+            if json_response['next']:
+                self.assertIn('fields=url%2Ctitle%2Ccreated_at',
+                              json_response['next'])
+
+        # an excerpt replaces the body
+        response = self.client.get(
+            url_for('api.get_posts', excerpt=12, cursor=''),
+            headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertIn('excerpt=12', json_response['next'])
+        for json_post in json_response['posts']:
+            self.assertNotIn('body', json_post)
+            self.assertNotIn('body_html', json_post)
+            post = Post.query.filter_by(
+                slug=json_post['url'].rsplit('/', 1)[-1]).first()
+            self.assertEqual(json_post['excerpt'], post.body[:12])
+            self.assertEqual(json_post['author'],
+                             url_for('api.get_user',
+                                     username=post.author.username,
+                                     _external=True))
+
+        response = self.client.get(
+            url_for('api.get_posts', fields='title', excerpt=5),
+            headers=self.get_api_headers('', ''))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(sorted(json_response['posts'][0].keys()),
+                         ['excerpt', 'title'])
+
+        for args in [{'fields': 'title,password'}, {'excerpt': 0},
+                     {'excerpt': 'x'}]:
+            response = self.client.get(
+                url_for('api.get_posts', **args),
+                headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 400)
+
+    def test_lookup_posts(self):
+        User.generate_fake(5)
+        Post.generate_fake(10)
+        posts = Post.query.order_by(Post.id).all()
+        slugs = [posts[3].slug, 'no-such-post', posts[0].slug,
+                 posts[3].slug]
+        response = self.client.get(
+            url_for('api.get_posts', slugs=','.join(slugs)),
+            headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual((json_response['found'], json_response['missing']),
+                         (3, 1))
+        results = json_response['results']
+        self.assertEqual([result['slug'] for result in results], slugs)
+        self.assertEqual([result['status'] for result in results],
+                         ['found', 'not found', 'found', 'found'])
+        self.assertNotIn('post', results[1])
+        self.assertEqual(results[0]['post'], posts[3].to_json())
+        self.assertEqual(results[2]['post'], posts[0].to_json())
+
+        # fieldsets apply, and the slugs are still matched
+        response = self.client.get(
+            url_for('api.get_posts', slugs=posts[1].slug, fields='title'),
+            headers=self.get_api_headers('', ''))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['results'][0]['post'],
+                         {'title': posts[1].title})
+
+        # one query for the posts and their authors, however many
+        few = self.count_queries(
+            url_for('api.get_posts', slugs=posts[0].slug))
+        many = self.count_queries(url_for(
+            'api.get_posts', slugs=','.join(post.slug for post in posts)))
+        self.assertEqual(few, many)
+
+        # unchanged lookups are not modified, and not serialized
+        url = url_for('api.get_posts', slugs=','.join(slugs), excerpt=5)
+        response = self.client.get(url, headers=self.get_api_headers('', ''))
+        headers = self.get_api_headers('', '')
+        headers['If-None-Match'] = response.headers['ETag']
+        db.session.remove()
+        n_queries = len(get_debug_queries())
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in get_debug_queries()[n_queries:]
+                          if 'substr' in query.statement.lower()])
+
+        self.app.config['POSTS_LOOKUP_SIZE'] = 2
+        for slugs in [',', ','.join(slugs)]:
+            response = self.client.get(
+                url_for('api.get_posts', slugs=slugs),
+                headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        self.create_john_cat()
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({
+                'body': 'body of the *blog* post',
+                'title': 'Title of blog',
+                }))
+        self.assertEqual(response.status_code, 201)
+        url = response.headers.get('Location')
+        urls = [
+            url,
+            url_for('api.get_posts'),
+            url_for('api.get_posts', cursor=''),
+            url_for('api.get_user', username='john'),
+            url_for('api.get_user_posts', username='john'),
+        ]
+        etags = {}
+        for u in urls:
+            response = self.client.get(u, headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers.get('ETag')
+            self.assertIsNotNone(etag)
+            etags[u] = etag
+
+            # matching ETag
+            headers = self.get_api_headers('', '')
+            headers['If-None-Match'] = etag
+            response = self.client.get(u, headers=headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers.get('ETag'), etag)
+
+            # another ETag
+            headers['If-None-Match'] = '"other"'
+            response = self.client.get(u, headers=headers)
+            self.assertEqual(response.status_code, 200)
+
+        # Last-Modified
+        response = self.client.get(url, headers=self.get_api_headers('', ''))
+        last_modified = response.headers.get('Last-Modified')
+        self.assertIsNotNone(last_modified)
+        headers = self.get_api_headers('', '')
+        headers['If-Modified-Since'] = last_modified
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+        # an edit changes the validators of the post and the listings
+        time.sleep(1)
+        response = self.client.put(
+            url,
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'body': 'updated body'}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        for u in urls:
+            headers = self.get_api_headers('', '')
+            headers['If-None-Match'] = etags[u]
+            response = self.client.get(u, headers=headers)
+            if u == url_for('api.get_user', username='john'):
+                self.assertEqual(response.status_code, 304)
+            else:
+                self.assertEqual(response.status_code, 200)
+
+    def check_response_cache(self):
+        self.create_john_cat()
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'body': 'body 1', 'title': 'Title 1'}))
+        self.assertEqual(response.status_code, 201)
+        url = response.headers.get('Location')
+        urls = [
+            url,
+            url_for('api.get_posts'),
+            url_for('api.get_user_posts', username='john'),
+        ]
+
+        # anonymous reads are served from the cache
+        first = {}
+        for u in urls:
+            response = self.client.get(u, headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 200)
+            first[u] = response.data
+        db.session.remove()
+        n_queries = len(get_debug_queries())
+        for u in urls:
+            response = self.client.get(u, headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, first[u])
+            headers = self.get_api_headers('', '')
+            headers['If-None-Match'] = response.headers['ETag']
+            response = self.client.get(u, headers=headers)
+            self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(get_debug_queries()), n_queries)
+
+        # a new post invalidates the listings but not the post
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'body': 'body 2', 'title': 'Title 2'}))
+        self.assertEqual(response.status_code, 201)
+        db.session.remove()
+        n_queries = len(get_debug_queries())
+        response = self.client.get(url, headers=self.get_api_headers('', ''))
+        self.assertEqual(len(get_debug_queries()), n_queries)
+        for u in urls[1:]:
+            response = self.client.get(u, headers=self.get_api_headers('', ''))
+            json_response = json.loads(response.data.decode('utf-8'))
+            self.assertEqual(json_response['count'], 2)
+
+        # an edit invalidates the post
+        response = self.client.put(
+            url,
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'body': 'updated body'}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, headers=self.get_api_headers('', ''))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['body'], 'updated body')
+
+        # authenticated reads bypass the cache
+        db.session.remove()
+        n_queries = len(get_debug_queries())
+        response = self.client.get(
+            url, headers=self.get_api_headers('john', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(get_debug_queries()), n_queries)
+
+    def test_response_cache_lru(self):
+        self.app.config['RESPONSE_CACHE_BACKEND'] = 'lru'
+        self.check_response_cache()
+
+    def test_response_cache_shared_backend(self):
+        self.app.config['RESPONSE_CACHE_BACKEND'] = PickleBackend
+        self.check_response_cache()
+        self.assertTrue(PickleBackend.store)
+
+    def test_response_cache_sqlite_backend(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.app.config.update(RESPONSE_CACHE_BACKEND='sqlite',
+                               RESPONSE_CACHE_SQLITE_PATH=path)
+        self.check_response_cache()
+
+    def test_response_cache_invalidated_in_every_worker(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        # two workers caching responses each, sharing the tag generations
+        other_app = create_app('testing')
+        for app in (self.app, other_app):
+            app.config['RESPONSE_CACHE_BACKEND'] = 'lru'
+            app.extensions['shared_cache'] = SQLiteCacheBackend(path)
+        self.create_john_cat()
+        db.session.remove()
+        response = self.client.get(url_for('api.get_posts'),
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['count'],
+                         0)
+
+        # the other worker takes the write
+        response = other_app.test_client().post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'body': 'body 1', 'title': 'Title 1'}))
+        self.assertEqual(response.status_code, 201)
+        db.session.remove()
+        response = self.client.get(url_for('api.get_posts'),
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['count'],
+                         1)
+
+    def test_lru_backend_bounded(self):
+        backend = LRUBackend(maxsize=2)
+        backend.set('response:1', 'cached')
+        for key in ('tag:a', 'tag:b'):
+            self.assertEqual(backend.incr(key), 1)
+        self.assertEqual(backend.get('response:1'), 'cached')
+        self.assertEqual(backend.incr('tag:a'), 2)
+
+        # the oldest counter goes, and the entries with it
+        self.assertEqual(backend.incr('tag:c'), 1)
+        self.assertIsNone(backend.get('tag:b'))
+        self.assertEqual(backend.get('tag:a'), 2)
+        self.assertIsNone(backend.get('response:1'))
+
+    def test_batch_posts(self):
+        self.create_john_cat()
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'body': 'body', 'title': 'Title'}))
+        self.assertEqual(response.status_code, 201)
+
+        # anonymous users cannot import
+        response = self.client.post(
+            url_for('api.new_posts'),
+            headers=self.get_api_headers('', ''),
+            data=json.dumps({'posts': []}))
+        self.assertEqual(response.status_code, 403)
+
+        # not a list of posts
+        response = self.client.post(
+            url_for('api.new_posts'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'posts': {'title': 'Title'}}))
+        self.assertEqual(response.status_code, 400)
+
+        # too many posts
+        self.app.config['POSTS_BATCH_SIZE'] = 2
+        response = self.client.post(
+            url_for('api.new_posts'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'posts': [{}, {}, {}]}))
+        self.assertEqual(response.status_code, 400)
+        self.app.config['POSTS_BATCH_SIZE'] = 100
+
+        # a per-item report, in request order
+        self.app.config['POSTS_IMPORT_CHUNK_SIZE'] = 2
+        response = self.client.post(
+            url_for('api.new_posts'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'posts': [
+                {'title': 'Title', 'body': 'body 2'},
+                {'title': 'Title'},
+                'not a post',
+                {'title': 'Title', 'body': 'body 3'},
+                {'title': 'Title 2', 'body': 'body 4'},
+                {'title': 'Other', 'body': 'body 5'},
+            ]}))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['created'], 4)
+        self.assertEqual(json_response['errors'], 2)
+        results = json_response['results']
+        self.assertEqual([r['status'] for r in results],
+                         ['created', 'error', 'error',
+                          'created', 'created', 'created'])
+        self.assertEqual(results[1]['message'], 'Post does not have a body')
+        urls = [r['url'] for r in results if r['status'] == 'created']
+        slugs = [u.rsplit('/', 1)[1] for u in urls]
+        self.assertEqual(slugs, ['title-2', 'title-3', 'title-2-2', 'other'])
+
+        # imported posts are readable
+        response = self.client.get(
+            urls[0], headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['body'], 'body 2')
+        self.assertIsNotNone(json_response['created_at'])
+        self.assertEqual(json_response['author'],
+                         url_for('api.get_user', username='john',
+                                 _external=True))
+        self.assertEqual(Post.query.count(), 5)
+
+    def test_search_posts(self):
+        self.create_john_cat()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        response = self.client.post(
+            url_for('api.new_post'), headers=headers,
+            data=json.dumps({'title': 'Search', 'body': 'a post on search'}))
+        self.assertEqual(response.status_code, 201)
+        # the slug of the search route is never allocated
+        self.assertTrue(response.headers['Location'].endswith('/search-2'))
+        posts = [{'title': 'Post {}'.format(i),
+                  'body': 'a body about flasks number {}'.format(i)}
+                 for i in range(25)]
+        posts.append({'title': 'Flasks', 'body': 'all about flasks'})
+        response = self.client.post(
+            url_for('api.new_posts'), headers=headers,
+            data=json.dumps({'posts': posts}))
+        self.assertEqual(response.status_code, 200)
+
+        # best match first, then every match once across the pages
+        url = url_for('api.search_posts', q='flasks', fields='title')
+        titles = []
+        while url:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            json_response = json.loads(response.data.decode('utf-8'))
+            titles.extend(post['title'] for post in json_response['posts'])
+            url = json_response['next']
+            if url:
+                self.assertIn('q=flasks', url)
+        self.assertEqual(titles[0], 'Flasks')
+        self.assertEqual(sorted(titles),
+                         sorted(post['title'] for post in posts))
+
+        # every word has to match
+        response = self.client.get(
+            url_for('api.search_posts', q='flasks "number 7'),
+            headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([post['title'] for post in json_response['posts']],
+                         ['Post 7'])
+
+        # edits are indexed
+        response = self.client.put(
+            url_for('api.edit_post', slug='post-7'), headers=headers,
+            data=json.dumps({'body': 'now about bottles'}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            url_for('api.search_posts', q='bottles'), headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([post['title'] for post in json_response['posts']],
+                         ['Post 7'])
+        response = self.client.get(
+            url_for('api.search_posts', q='flasks number 7'),
+            headers=headers)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['posts'], [])
+
+        for args in [{}, {'q': '!!'}, {'q': 'flasks', 'cursor': 'bad'}]:
+            response = self.client.get(
+                url_for('api.search_posts', **args), headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_tied_ranks(self):
+        n_per_page = self.app.config['POSTS_PER_PAGE']
+        User.generate_fake(1)
+        Post.generate_fake(3 * n_per_page)
+        # more ties than a page, on a rank with no exact decimal form
+        rank = db.cast(db.literal(1.0) / 3, db.Float(precision=53))
+        ids = []
+        cursor = ''
+        while cursor is not None:
+            with self.app.test_request_context(
+                    url_for('api.search_posts', cursor=cursor)):
+                page = paginate_ranked(Post.query, rank, 'api.search_posts')
+            ids.extend(post.id for post in page.items)
+            cursor = page.next and parse_qs(
+                urlsplit(page.next).query)['cursor'][0]
+        self.assertEqual(ids, sorted(post.id for post in Post.query))
+
+        # the Postgres rank is a double, like the cursor
+        query, rank = match(Post.query, ['flasks'], Post,
+                            dialect='postgresql')
+        self.assertIn('AS FLOAT(53)',
+                      str(rank.compile(dialect=postgresql.dialect())))
+
+    def test_stream_posts(self):
+        User.generate_fake(3)
+        Post.generate_fake(25)
+        self.app.config['POSTS_STREAM_BATCH_SIZE'] = 7
+        u = User.query.first()
+        for url, query in [
+                (url_for('api.get_posts', stream=1), Post.query),
+                (url_for('api.get_user_posts', username=u.username,
+                         stream=1), u.posts)]:
+            response = self.client.get(url,
+                                       headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.headers.get('Content-Length'))
+            json_response = json.loads(response.data.decode('utf-8'))
+            posts = query.order_by(Post.created_at.desc(),
+                                   Post.id.desc()).all()
+            self.assertEqual([post['url'] for post in json_response['posts']],
+                             [url_for('api.get_post', slug=post.slug,
+                                      _external=True) for post in posts])
+            self.assertEqual(sorted(json_response['posts'][0].keys()),
+                             sorted(Post.JSON_FIELDS))
+            self.assertEqual(json_response['posts'][0]['body'], posts[0].body)
+
+        response = self.client.get(
+            url_for('api.get_posts', stream=1, fields='title', excerpt=3),
+            headers=self.get_api_headers('', ''))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(json_response['posts']), 25)
+        self.assertEqual(sorted(json_response['posts'][0].keys()),
+                         ['excerpt', 'title'])
+
+    def test_compression(self):
+        User.generate_fake(1)
+        Post.generate_fake(10)
+        url = url_for('api.get_posts')
+        plain = self.client.get(url, headers=self.get_api_headers('', ''))
+        self.assertIsNone(plain.headers.get('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain.headers.get('Vary'))
+
+        headers = self.get_api_headers('', '')
+        headers['Accept-Encoding'] = 'deflate;q=0.5, gzip'
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertEqual(response.headers.get('ETag'),
+                         'W/' + plain.headers.get('ETag'))
+
+        # the weak ETag still validates
+        headers['If-None-Match'] = response.headers.get('ETag')
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        del headers['If-None-Match']
+
+        headers['Accept-Encoding'] = 'deflate'
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'deflate')
+        self.assertEqual(zlib.decompress(response.data), plain.data)
+
+        # streamed responses are compressed as they go
+        response = self.client.get(url_for('api.get_posts', stream=1),
+                                   headers=headers)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'deflate')
+        self.assertEqual(len(json.loads(zlib.decompress(
+            response.data).decode('utf-8'))['posts']), 10)
+
+        # small responses are not
+        response = self.client.get(url_for('api.get_posts', fields='title'),
+                                   headers=headers)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+    def test_serialization(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat',
+                 username='john.doe_1', role=r)
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        response = self.client.post(
+            url_for('api.new_post'), headers=headers,
+            data=json.dumps({'title': 'Title', 'body': 'body'}))
+        self.assertEqual(response.status_code, 201)
+        post = Post.query.first()
+
+        response = self.client.get(url_for('api.get_user_posts',
+                                           username='john.doe_1'),
+                                   headers=headers)
+        json_post = json.loads(response.data.decode('utf-8'))['posts'][0]
+        self.assertEqual(json_post['url'], url_for(
+            'api.get_post', slug=post.slug, _external=True))
+        self.assertEqual(json_post['author'], url_for(
+            'api.get_user', username='john.doe_1', _external=True))
+        self.assertEqual(datetime.strptime(json_post['created_at'],
+                                           self.datetime_format),
+                         post.created_at.replace(microsecond=0))
+
+        # a pluggable encoder, and ISO 8601 datetimes
+        encoded = []
+
+        def dumps(obj):
+            encoded.append(obj)
+            return json.dumps(obj)
+
+        self.app.config['API_JSON_ENCODER'] = dumps
+        self.app.config['API_DATETIME_FORMAT'] = 'iso8601'
+        serializer.init_app(self.app)
+        response = self.client.get(url_for('api.get_post', slug=post.slug),
+                                   headers=headers)
+        json_post = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(encoded, [json_post])
+        self.assertEqual(datetime.strptime(json_post['created_at'],
+                                           '%Y-%m-%dT%H:%M:%S.%fZ'),
+                         post.created_at)
+
+    def test_pool_metrics(self):
+        self.create_john_cat()
+        adminr = Role.query.filter_by(name='Administrator').first()
+        adminu = User(email='admin@example.com', username='admin',
+                      password='cat', role=adminr)
+        db.session.add(adminu)
+        db.session.commit()
+
+        # only administrators can read the pool metrics
+        response = self.client.get(
+            url_for('api.get_pool_metrics'),
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get(
+            url_for('api.get_pool_metrics'),
+            headers=self.get_api_headers('admin@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        pool = json_response['pools']['default']
+        self.assertEqual(pool['pool'], 'NullPool')
+        self.assertGreater(pool['checkouts'], 0)
+
+    def test_instrumentation(self):
+        self.create_john_cat()
+        adminr = Role.query.filter_by(name='Administrator').first()
+        db.session.add(User(email='admin@example.com', username='admin',
+                            password='cat', role=adminr))
+        db.session.commit()
+
+        response = self.client.get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        timing = dict(metric.split(';', 1)[0:2] for metric in
+                      response.headers['Server-Timing'].split(', '))
+        for name in ['auth', 'db', 'handler', 'serialize', 'total']:
+            self.assertIn(name, timing)
+        self.assertRegex(timing['db'], r'dur=[\d.]+;desc="\d+ queries"')
+
+        # everything is slow with zero thresholds
+        self.app.config['SLOW_REQUEST_MS'] = 0
+        self.app.config['SLOW_QUERY_MS'] = 0
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            response = self.client.get(
+                url_for('api.get_posts'),
+                headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertTrue(any('Slow query' in line for line in logs.output))
+        self.assertTrue(any('Slow request' in line and '/posts/' in line
+                            for line in logs.output))
+        self.app.config['SLOW_REQUEST_MS'] = 500
+        self.app.config['SLOW_QUERY_MS'] = 100
+
+        # only administrators can read the metrics
+        response = self.client.get(
+            url_for('api.get_request_metrics'),
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            url_for('api.get_request_metrics'),
+            headers=self.get_api_headers('admin@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        posts = json_response['endpoints']['api.get_posts']
+        self.assertEqual(posts['count'], 2)
+        self.assertEqual(posts['statuses'], {'2xx': 2})
+        self.assertEqual(posts['latency']['buckets']['+Inf'], 2)
+        self.assertGreater(posts['queries'], 0)
+        self.assertEqual(json_response['slow_requests'], 1)
+        self.assertGreater(json_response['slow_queries'], 0)
+        self.assertEqual(json_response['queries']['count'],
+                         sum(endpoint['queries'] for endpoint
+                             in json_response['endpoints'].values()))
+
+        # Server-Timing can be turned off
+        self.app.config['SERVER_TIMING'] = False
+        response = self.client.get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_capture(self):
+        self.create_john_cat()
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.app.config['CAPTURE_FILE'] = path
+        self.app.config['CAPTURE_BODIES'] = True
+
+        response = self.client.get(
+            url_for('api.get_posts', page=1),
+            headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'title': 'Captured', 'body': 'a body'}))
+        self.assertEqual(response.status_code, 201)
+        response = self.client.put(
+            url_for('api.change_password', username='john'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'password': 'dog'}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers('john@example.com', 'bad'))
+        self.assertEqual(response.status_code, 403)
+
+        with open(path) as f:
+            captured = f.read()
+        records = [json.loads(line) for line in captured.splitlines()]
+        self.assertEqual([(record['method'], record['endpoint'],
+                           record['auth'], record['status'])
+                          for record in records],
+                         [('GET', 'api.get_posts', 'anonymous', 200),
+                          ('POST', 'api.new_post', 'basic', 201),
+                          ('PUT', 'api.change_password', 'basic', 200),
+                          ('GET', 'api.get_posts', 'basic', 403)])
+        self.assertEqual(records[0]['args'], {'page': ['1']})
+        self.assertEqual(records[0]['path'], '/api/v1.0/posts/')
+        self.assertNotIn('body', records[0])
+        self.assertEqual(records[1]['body'],
+                         {'title': 'Captured', 'body': 'a body'})
+        self.assertEqual(records[2]['body'], {'password': '<redacted>'})
+        self.assertGreater(records[1]['duration'], 0)
+        # no credential, or anything derived from one, is written
+        for secret in ['cat', 'dog', 'bad', 'Basic', b64encode(
+                b'john@example.com:cat').decode('utf-8')]:
+            self.assertNotIn('"' + secret, captured)
+
+        # without a file nothing is captured
+        self.app.config['CAPTURE_FILE'] = None
+        self.client.get(url_for('api.get_posts'),
+                        headers=self.get_api_headers('', ''))
+        with open(path) as f:
+            self.assertEqual(f.read(), captured)
+
+    def use_rate_limits(self, **limits):
+        clock = [1000.0]
+        self.app.config.update(limits)
+        self.app.extensions['rate_limiter'] = MemoryBackend(
+            timer=lambda: clock[0])
+        return clock
+
+    def test_rate_limit_requests(self):
+        self.create_john_cat()
+        clock = self.use_rate_limits(RATELIMIT_IP=(1, 3),
+                                     RATELIMIT_PRINCIPAL=(1, 2))
+        for i in range(3):
+            response = self.client.get(url_for('api.get_posts'),
+                                       headers=self.get_api_headers('', ''))
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get(url_for('api.get_posts'),
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['error'], 'too many requests')
+
+        # other addresses have their own bucket
+        response = self.client.get(url_for('api.get_posts'),
+                                   headers=self.get_api_headers('', ''),
+                                   environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(response.status_code, 200)
+
+        # buckets refill
+        clock[0] += 1
+        response = self.client.get(url_for('api.get_posts'),
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+
+        # a principal is limited whatever its address
+        for i, status in enumerate([200, 200, 429]):
+            response = self.client.get(
+                url_for('api.get_posts'),
+                headers=self.get_api_headers('john@example.com', 'cat'),
+                environ_base={'REMOTE_ADDR': '10.0.1.{}'.format(i)})
+            self.assertEqual(response.status_code, status)
+
+    def test_rate_limit_auth_failures(self):
+        self.create_john_cat()
+        clock = self.use_rate_limits(RATELIMIT_AUTH_FAILURES=(0.1, 2))
+        for i in range(2):
+            response = self.client.get(
+                url_for('api.get_posts'),
+                headers=self.get_api_headers('john@example.com', 'dog'))
+            self.assertEqual(response.status_code, 403)
+
+        # throttled before the user is looked up, even with the password
+        n_queries = len(get_debug_queries())
+        response = self.client.get(
+            url_for('api.get_token'),
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '10')
+        self.assertEqual(len(get_debug_queries()), n_queries)
+
+        # from another address the principal is still throttled
+        response = self.client.get(
+            url_for('api.get_token'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(response.status_code, 429)
+
+        # and so is the address, for other principals
+        response = self.client.get(
+            url_for('api.get_token'),
+            headers=self.get_api_headers('susan@example.com', 'dog'))
+        self.assertEqual(response.status_code, 429)
+
+        # successful requests do not count as failures
+        clock[0] += 10
+        for i in range(3):
+            response = self.client.get(
+                url_for('api.get_token'),
+                headers=self.get_api_headers('john@example.com', 'cat'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_rate_limit_sqlite_backend(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        clock = [1000.0]
+        # two workers sharing the file
+        worker1 = SQLiteBackend(path, timer=lambda: clock[0])
+        worker2 = SQLiteBackend(path, timer=lambda: clock[0])
+        self.assertEqual(worker1.take('key', 1, 2), 0)
+        self.assertEqual(worker2.take('key', 1, 2), 0)
+        self.assertEqual(worker1.take('key', 1, 2), 1)
+        self.assertEqual(worker2.take('key', 1, 2, cost=0), 1)
+        clock[0] += 0.5
+        self.assertEqual(worker2.take('key', 1, 2), 0.5)
+        clock[0] += 0.5
+        self.assertEqual(worker2.take('key', 1, 2), 0)
+        self.assertEqual(worker1.take('other', 1, 2), 0)
@@ -3,6 +3,8 @@ from flask import current_app
 
 from app import create_app
 from app import db
+from app.serving import uwsgi_ini
+from app.serving import uwsgi_options
 
 
 class BasicTestCase(unittest.TestCase):
@@ -22,3 +24,24 @@ class BasicTestCase(unittest.TestCase):
 
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
+
+    def test_uwsgi_profile(self):
+        config = dict(current_app.config, UWSGI_PROCESSES=4,
+                      UWSGI_THREADS=16)
+        options = dict(uwsgi_options(config))
+        self.assertEqual((options['processes'], options['threads']),
+                         (4, 16))
+        self.assertTrue(options['master'])
+
+        # threads do not outnumber the connections of the pool
+        config.update(SQLALCHEMY_POOL_SIZE=5, SQLALCHEMY_MAX_OVERFLOW=3)
+        self.assertEqual(dict(uwsgi_options(config))['threads'], 8)
+        config['UWSGI_PROCESSES'] = 0
+        self.assertGreaterEqual(dict(uwsgi_options(config))['processes'], 1)
+
+        ini = uwsgi_ini(config, '/tmp/app.sock').splitlines()
+        self.assertEqual(ini[:4], ['[uwsgi]', 'socket = /tmp/app.sock',
+                                   'module = manage:app',
+                                   'env = FLASK_CONFIG=testing'])
+        self.assertIn('threads = 8', ini)
+        self.assertIn('thunder-lock = true', ini)
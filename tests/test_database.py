@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+from flask import url_for
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from app import create_app
+from app import db
+from app.models import Post
+from app.models import Role
+from app.models import User
+from app.database import metered
+from app.database import ping_connection
+from app.caches import SQLiteBackend
+from config import config
+from config import TestingConfig
+
+REPLICA_PATH = os.path.join(tempfile.gettempdir(), 'data-test-replica.sqlite')
+
+
+class ReplicaTestingConfig(TestingConfig):
+    SERVER_NAME = 'test.test'
+    SQLALCHEMY_REPLICA_URIS = ['sqlite:///' + REPLICA_PATH]
+
+
+config['testing-replica'] = ReplicaTestingConfig
+
+# long enough to outlast any statement timeout used here
+SLOW_QUERY = '''
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+SELECT count(*) FROM (SELECT i FROM n LIMIT 100000000)
+'''
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_STATEMENT_TIMEOUT'] = 50
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_pool_metrics(self):
+        before = db.pool_metrics()
+        self.assertEqual(before['pool'], 'NullPool')
+        for i in range(3):
+            db.session.execute('SELECT 1')
+            db.session.remove()
+        after = db.pool_metrics()
+        self.assertEqual(after['checkouts'], before['checkouts'] + 3)
+        self.assertEqual(after['connects'], before['connects'] + 3)
+        self.assertGreaterEqual(after['max_wait'], after['mean_wait'])
+
+        # a disposed engine keeps counting
+        db.engine.dispose()
+        db.session.execute('SELECT 1')
+        db.session.remove()
+        self.assertEqual(db.pool_metrics()['checkouts'],
+                         after['checkouts'] + 1)
+
+    def test_statement_timeout(self):
+        with self.assertRaises(exc.OperationalError):
+            db.session.execute(SLOW_QUERY)
+        db.session.rollback()
+
+        # the deadline only applies to the statement that set it
+        self.assertEqual(db.session.execute('SELECT 1').scalar(), 1)
+
+    def test_queue_pool_metrics(self):
+        engine = create_engine('sqlite://', poolclass=metered(QueuePool),
+                               pool_size=1, max_overflow=0, pool_timeout=0.1)
+        connection = engine.connect()
+        metrics = engine.pool.metrics.to_json(engine.pool)
+        self.assertEqual(metrics['pool'], 'QueuePool')
+        self.assertEqual(metrics['size'], 1)
+        self.assertEqual(metrics['checked_out'], 1)
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+        self.assertEqual(engine.pool.metrics.timeouts, 1)
+        connection.close()
+        self.assertEqual(engine.pool.checkedout(), 0)
+
+    def test_pre_ping(self):
+        engine = create_engine('sqlite://', poolclass=metered(QueuePool),
+                               pool_size=1, max_overflow=0)
+        event.listen(engine, 'checkout', ping_connection)
+        connection = engine.connect()
+        dbapi_connection = connection.connection.connection
+        connection.close()
+
+        # the database went away while the connection sat in the pool
+        dbapi_connection.close()
+        connection = engine.connect()
+        self.assertIsNot(connection.connection.connection, dbapi_connection)
+        self.assertEqual(connection.scalar('SELECT 1'), 1)
+        connection.close()
+
+
+class ReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing-replica')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        r = Role.query.filter_by(name='User').first()
+        db.session.add(User(email='john@example.com', username='john',
+                            password='cat', role=r))
+        db.session.commit()
+        db.session.remove()
+        # the replica starts as a copy of the primary
+        shutil.copy(db.engine.url.database, REPLICA_PATH)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        os.remove(REPLICA_PATH)
+
+    def get_api_headers(self, username, password):
+        headers = {'Accept': 'application/json',
+                   'Content-Type': 'application/json'}
+        if username:
+            headers['Authorization'] = 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8')
+        return headers
+
+    def get_titles(self, username, password):
+        response = self.client.get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers(username, password))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        return [post['title'] for post in json_response['posts']]
+
+    def test_replica_reads(self):
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'title': 'Written', 'body': 'to the primary'}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.query.count(), 1)
+
+        # the writer reads its own write from the primary ...
+        self.assertEqual(self.get_titles('john@example.com', 'cat'),
+                         ['Written'])
+        # ... while everyone else reads the (lagging) replica
+        self.assertEqual(self.get_titles('', ''), [])
+        response = self.client.get(
+            url_for('api.get_post', slug='written'),
+            headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 404)
+
+        # once the window is over the writer is back on the replica
+        self.app.extensions['shared_cache'].clear()
+        self.assertEqual(self.get_titles('john@example.com', 'cat'), [])
+
+        # the replica catches up
+        db.session.remove()
+        shutil.copy(db.engine.url.database, REPLICA_PATH)
+        self.assertEqual(self.get_titles('', ''), ['Written'])
+
+    def test_sticky_writer_in_every_worker(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        # two workers sharing a cache file
+        other_app = create_app('testing-replica')
+        for app in (self.app, other_app):
+            app.extensions['shared_cache'] = SQLiteBackend(path)
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'title': 'Written', 'body': 'to the primary'}))
+        self.assertEqual(response.status_code, 201)
+        db.session.remove()
+
+        # the writer's next read reaches the other worker
+        response = other_app.test_client().get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([post['title'] for post in json_response['posts']],
+                         ['Written'])
+
+    def test_response_cache_of_replica_reads(self):
+        self.app.config.update(RESPONSE_CACHE_BACKEND='lru',
+                               SQLALCHEMY_REPLICA_STICKINESS=0.2)
+        response = self.client.post(
+            url_for('api.new_post'),
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps({'title': 'Written', 'body': 'to the primary'}))
+        self.assertEqual(response.status_code, 201)
+
+        # anonymous reads are not sent to the primary ...
+        self.assertEqual(self.get_titles('', ''), [])
+        db.session.remove()
+        shutil.copy(db.engine.url.database, REPLICA_PATH)
+        self.assertEqual(self.get_titles('', ''), [])
+
+        # ... and their page is cached no longer than the replica may lag
+        time.sleep(0.2)
+        self.assertEqual(self.get_titles('', ''), ['Written'])
+
+    def test_replica_pool_metrics(self):
+        self.get_titles('', '')
+        metrics = db.pool_metrics(bind='replica0')
+        self.assertGreater(metrics['checkouts'], 0)
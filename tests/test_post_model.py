@@ -1,4 +1,5 @@
 import unittest
+from datetime import datetime
 
 from app import create_app
 from app import db
@@ -94,3 +95,173 @@ class UserModelTestCase(unittest.TestCase):
         db.session.add(p)
         db.session.commit()
         self.assertEqual(p.slug, 'title-json')
+
+    def test_slug_numbering(self):
+        for title in ['Title', 'Title 2', 'Title', 'Title', 'Title Json']:
+            db.session.add(Post(title=title, body='body'))
+            db.session.commit()
+        slugs = [p.slug for p in Post.query.order_by(Post.id)]
+        self.assertEqual(slugs, ['title', 'title-2', 'title-3', 'title-4',
+                                 'title-json'])
+
+        # a freed base slug is reused
+        p = Post.query.filter_by(slug='title').first()
+        p.title = 'Other'
+        db.session.commit()
+        self.assertEqual(Post.next_slug('title'), 'title')
+        self.assertEqual(Post.next_slug('other'), 'other-2')
+
+    def test_slug_conflict_retry(self):
+        p = Post(title='Title', body='body 1')
+        p.save()
+        self.assertEqual(p.slug, 'title')
+
+        # a concurrent writer took the slug after it was allocated
+        p2 = Post(title='Title', body='body 2')
+        p2.slug = 'title'
+        p2.save()
+        self.assertEqual(p2.slug, 'title-2')
+
+        # edits survive the retry
+        p3 = Post(title='Another', body='body 3')
+        p3.save()
+        p3.title = 'Title'
+        p3.body = 'body 4'
+        p3.slug = 'title-2'
+        p3.save()
+        self.assertEqual(p3.slug, 'title-3')
+        self.assertEqual(p3.title, 'Title')
+        self.assertEqual(p3.body, 'body 4')
+
+    def test_allocate_slugs(self):
+        for title in ['Title', 'Title 3']:
+            db.session.add(Post(title=title, body='body'))
+        db.session.commit()
+        slugs = Post.allocate_slugs(['Other', 'Title', 'Other', 'New',
+                                     'Title'])
+        self.assertEqual(slugs, ['other', 'title-4', 'other-2', 'new',
+                                 'title-5'])
+        self.assertEqual(Post.allocate_slugs(['Search', 'Search']),
+                         ['search-2', 'search-3'])
+
+    def test_generate_fake(self):
+        from app.fake import generate
+        from app.fake import DATE_EPOCH
+        from app.fake import DATE_SPAN
+        generate(5, 30, seed=1, batch_size=7)
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(Post.query.count(), 30)
+        slugs = [slug for slug, in db.session.query(Post.slug)]
+        self.assertEqual(len(set(slugs)), 30)
+        dates = [created_at for created_at,
+                 in db.session.query(Post.created_at).order_by(Post.id)]
+        # dated from a fixed day, not from today
+        self.assertTrue(all(DATE_EPOCH - DATE_SPAN <= created_at <= DATE_EPOCH
+                            for created_at in dates))
+        u = User.query.first()
+        self.assertTrue(u.verify_password('password'))
+        self.assertEqual(u.role.name, 'User')
+
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        generate(5, 30, seed=1, batch_size=7)
+        self.assertEqual(
+            [slug for slug, in db.session.query(Post.slug)], slugs)
+        self.assertEqual(
+            [created_at for created_at,
+             in db.session.query(Post.created_at).order_by(Post.id)], dates)
+
+    def test_body_html(self):
+        p = Post(title='Title', body='*hi* <script>alert(1)</script>')
+        p.save()
+        self.assertEqual(p.body_html, '<p><em>hi</em> alert(1)</p>')
+        digest = p.body_html_digest
+        p.body = '**bold** http://example.com'
+        p.save()
+        self.assertEqual(
+            p.body_html,
+            '<p><strong>bold</strong> <a href="http://example.com"'
+            ' rel="nofollow">http://example.com</a></p>')
+        self.assertNotEqual(p.body_html_digest, digest)
+
+    def test_rerender(self):
+        for i in range(5):
+            Post(title='Title {}'.format(i), body='*body {}*'.format(i)).save()
+        updated_at = [p.updated_at for p in Post.query.order_by(Post.id)]
+        db.session.execute(Post.__table__.update()
+                           .where(Post.id > 3)
+                           .values(body_html=None, body_html_digest=None,
+                                   updated_at=Post.updated_at))
+        db.session.commit()
+        batches = list(Post.rerender(batch_size=2, processes=1))
+        self.assertEqual([checked for checked, _ in batches], [2, 2, 1])
+        self.assertEqual([slug for _, rendered in batches
+                          for slug, _ in rendered], ['title-3', 'title-4'])
+        db.session.expire_all()
+        posts = Post.query.order_by(Post.id).all()
+        self.assertEqual(posts[4].body_html, '<p><em>body 4</em></p>')
+        self.assertEqual([p.updated_at for p in posts], updated_at)
+        batches = list(Post.rerender(processes=1, force=True))
+        self.assertEqual(len(batches[0][1]), 5)
+
+    def test_post_counts(self):
+        u1 = User(username='john', email='john@example.com', password='cat')
+        u2 = User(username='susan', email='susan@example.com', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual((u1.post_count, u1.last_post_at), (0, None))
+
+        p1 = Post(title='First', body='body', author=u1,
+                  created_at=datetime(2017, 1, 1))
+        p2 = Post(title='Second', body='body', author=u1,
+                  created_at=datetime(2017, 2, 1))
+        db.session.add_all([p1, p2])
+        db.session.flush()
+        # loaded authors see the counters before the commit
+        self.assertEqual((u1.post_count, u1.last_post_at),
+                         (2, datetime(2017, 2, 1)))
+        db.session.commit()
+
+        # moving a post updates both authors
+        p2.author = u2
+        db.session.commit()
+        self.assertEqual((u1.post_count, u1.last_post_at),
+                         (1, datetime(2017, 1, 1)))
+        self.assertEqual((u2.post_count, u2.last_post_at),
+                         (1, datetime(2017, 2, 1)))
+        p2.author_id = u1.id
+        db.session.commit()
+        self.assertEqual((u1.post_count, u2.post_count), (2, 0))
+        p2.author = u2
+        db.session.commit()
+
+        db.session.delete(p1)
+        db.session.commit()
+        self.assertEqual((u1.post_count, u1.last_post_at), (0, None))
+
+        # bulk imports count their rows
+        results = list(Post.import_json(
+            [{'title': 'Imported {}'.format(i), 'body': 'body'}
+             for i in range(3)] + [{'title': ''}], u1.id, chunk_size=2))
+        self.assertEqual(len(results), 4)
+        self.assertEqual(u1.post_count, 3)
+        self.assertIsNotNone(u1.last_post_at)
+
+        # recount only corrects the users that drifted
+        self.assertEqual([usernames for _, usernames in User.recount()],
+                         [[]])
+        db.session.execute(User.__table__.update().values(post_count=7))
+        db.session.commit()
+        self.assertEqual([usernames for _, usernames
+                          in User.recount(batch_size=1)],
+                         [['john'], ['susan']])
+        self.assertEqual((u1.post_count, u2.post_count), (3, 1))
+
+    def test_generate_fake_post_counts(self):
+        from app.fake import generate
+        generate(5, 30, seed=1, batch_size=7)
+        self.assertEqual(
+            sum(count for count, in db.session.query(User.post_count)), 30)
+        self.assertEqual(
+            [usernames for _, usernames in User.recount()], [[]])
@@ -1,12 +1,19 @@
+import os
 import unittest
 import time
+import tempfile
+from flask_sqlalchemy import get_debug_queries
 
 from app import create_app
 from app import db
+from app import credential_cache
+from app import principal_cache
 from app.models import User
 from app.models import Role
 from app.models import AnonymousUser
+from app.models import Principal
 from app.models import Permission
+from app.caches import SQLiteBackend
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -50,6 +57,61 @@ class UserModelTestCase(unittest.TestCase):
         u2 = User(password='cat')
         self.assertTrue(u.password_hash != u2.password_hash)
 
+    def test_credential_cache(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertFalse(credential_cache.verify(u, 'dog'))
+        self.assertEqual(len(credential_cache.cache), 0)
+        self.assertTrue(credential_cache.verify(u, 'cat'))
+        self.assertEqual(len(credential_cache.cache), 1)
+        self.assertTrue(credential_cache.verify(u, 'cat'))
+
+        # a new password hash drops the cached credentials
+        u.password = 'dog'
+        self.assertEqual(len(credential_cache.cache), 0)
+        self.assertFalse(credential_cache.verify(u, 'cat'))
+        self.assertTrue(credential_cache.verify(u, 'dog'))
+
+    def test_find_by_login(self):
+        u1 = User(username='john', email='john@example.com', password='cat')
+        u2 = User(username='susan', email='john', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(User.find_by_login('john@example.com'), u1)
+        self.assertEqual(User.find_by_login('susan'), u2)
+        # usernames win over emails
+        self.assertEqual(User.find_by_login('john'), u1)
+        self.assertIsNone(User.find_by_login('david'))
+
+        # a renamed user is found under a name that was unknown
+        u2.username = 'david'
+        db.session.commit()
+        self.assertEqual(User.find_by_login('david'), u2)
+
+    def test_new_user_found_in_every_worker(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        # two workers sharing a cache file
+        other_app = create_app('testing')
+        for app in (self.app, other_app):
+            app.extensions['shared_cache'] = SQLiteBackend(path)
+        self.assertIsNone(User.find_by_login('john'))
+        n_queries = len(get_debug_queries())
+        self.assertIsNone(User.find_by_login('john'))
+        self.assertEqual(len(get_debug_queries()), n_queries)
+        db.session.remove()
+
+        with other_app.app_context():
+            db.session.add(User(username='john', email='john@example.com',
+                                password='cat'))
+            db.session.commit()
+            db.session.remove()
+
+        self.assertEqual(User.find_by_login('john').email,
+                         'john@example.com')
+
     def test_valid_authorization_token(self):
         u = User(password='cat')
         db.session.add(u)
@@ -74,16 +136,117 @@ class UserModelTestCase(unittest.TestCase):
         time.sleep(2)
         self.assertTrue(User.verify_auth_token(token) != u)
 
+    def test_principal_from_token(self):
+        u = User(username='john', email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token(expiration=3600)
+        p = Principal.from_token(token)
+        self.assertEqual(p.id, u.id)
+        self.assertEqual(p.username, 'john')
+        self.assertTrue(p.can(Permission.WRITE_ARTICLES))
+        self.assertFalse(p.is_administrator())
+        self.assertIsNone(Principal.from_token('bad-token'))
+
+        # a role change invalidates earlier tokens
+        u.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        self.assertIsNone(Principal.from_token(token))
+        self.assertIsNone(User.verify_auth_token(token))
+        token = u.generate_auth_token(expiration=3600)
+        self.assertTrue(Principal.from_token(token).is_administrator())
+
+    def test_principal_invalidated_in_every_worker(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        # two workers sharing a cache file
+        other_app = create_app('testing')
+        for app in (self.app, other_app):
+            app.extensions['shared_cache'] = SQLiteBackend(path)
+        u = User(username='john', email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        token = u.generate_auth_token(expiration=3600)
+        self.assertIsNotNone(Principal.from_token(token))
+        db.session.remove()
+
+        with other_app.app_context():
+            u = User.query.get(user_id)
+            u.password = 'dog'
+            db.session.commit()
+            db.session.remove()
+
+        # the first worker still caches the principal, but not for the token
+        self.assertIsNone(Principal.from_token(token))
+
+    def test_role_change_in_every_worker(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        # two workers sharing a cache file
+        other_app = create_app('testing')
+        for app in (self.app, other_app):
+            app.extensions['shared_cache'] = SQLiteBackend(path)
+        u = User(username='john', email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        role_id = u.role_id
+        token = u.generate_auth_token(expiration=3600)
+        self.assertTrue(Principal.from_token(token).can(
+            Permission.WRITE_ARTICLES))
+        db.session.remove()
+
+        with other_app.app_context():
+            r = Role.query.get(role_id)
+            r.permissions = Permission.READ_ARTICLES
+            db.session.commit()
+            principal_cache.invalidate()
+            db.session.remove()
+
+        # the first worker reloads its roles and drops the principal
+        self.assertEqual(Role.permissions_for(role_id),
+                         Permission.READ_ARTICLES)
+        self.assertIsNone(Principal.from_token(token))
+
     def test_roles_and_permissions(self):
         u = User(email='john@example.com', password='cat')
         r = Role.query.filter_by(name='User').first()
-        self.assertEqual(u.role, r)
+        self.assertEqual(u.role_id, r.id)
         self.assertFalse(u.is_administrator())
         self.assertTrue(u.can(Permission.READ_ARTICLES))
         self.assertTrue(u.can(Permission.WRITE_ARTICLES))
         self.assertFalse(u.can(Permission.CREATE_USERS))
         self.assertFalse(u.can(Permission.ADMINISTER))
 
+    def test_permissions_without_queries(self):
+        Role.registry()
+        n_queries = len(get_debug_queries())
+        u = User(email='john@example.com', username='john', password='cat')
+        # the role comes from the registry
+        self.assertEqual(len(get_debug_queries()), n_queries)
+        db.session.add(u)
+        db.session.commit()
+        db.session.remove()
+        u = User.query.filter_by(username='john').first()
+        n_queries = len(get_debug_queries())
+        self.assertTrue(u.can(Permission.WRITE_ARTICLES))
+        self.assertFalse(u.is_administrator())
+        self.assertEqual(len(get_debug_queries()), n_queries)
+
+        # insert_roles refreshes the registry
+        r = Role.query.filter_by(name='User').first()
+        r.permissions = Permission.READ_ARTICLES
+        db.session.commit()
+        self.assertTrue(u.can(Permission.WRITE_ARTICLES))
+        Role.insert_roles()
+        self.assertTrue(u.can(Permission.WRITE_ARTICLES))
+        r.permissions = Permission.READ_ARTICLES
+        db.session.commit()
+        Role.load_registry()
+        self.assertFalse(u.can(Permission.WRITE_ARTICLES))
+
     def test_anonymous_user(self):
         u = AnonymousUser()
         self.assertFalse(u.is_administrator())
@@ -109,9 +272,12 @@ class UserModelTestCase(unittest.TestCase):
         db.session.add(u)
         db.session.commit()
         json_user = u.to_json()
-        expected_keys = ['url', 'username', 'email', 'posts']
+        expected_keys = ['url', 'username', 'email', 'posts', 'post_count',
+                         'last_post_at']
         self.assertEqual(sorted(json_user.keys()), sorted(expected_keys))
         self.assertTrue('api/v1.0/users/' in json_user['url'])
+        self.assertEqual(json_user['post_count'], 0)
+        self.assertIsNone(json_user['last_post_at'])
 
     def test_from_json(self):
         json_user = {